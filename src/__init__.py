@@ -11,6 +11,7 @@ FOSH_TURN_SPEED = 3.6
 FOSH_TAIL_LEN = 20
 
 SATURATION = 30
+SPEED_TICK = 1 / 30  # the speed changes when chasing food are tuned per tick of this length (in s)
 
 OUT_DIR = join(".", "out", "")
 SCALE = 1.0  # in px/unit
@@ -24,5 +25,6 @@ PALETTE = {  # in bgr (expected by opencv)
 
 
 from src.fosh import fosh
-from src.canvas import Canvas
+from src.swarm import Swarm
+from src.canvas import Canvas, NullCanvas
 from src.universe import Universe
@@ -1,7 +1,15 @@
 from argparse import ArgumentParser
+from functools import partial
 from os import remove
+from os.path import exists
+from time import perf_counter
 from src import PALETTE, DEFAULT_NUM_NEIGHBORS, DEFAULT_VIEW_DIST
-from src import Universe, Canvas, fosh
+from src import Universe, Canvas, NullCanvas, fosh
+from src.recorder import RECORD_POLICIES
+from src.profiler import Profiler
+from src.trajectory import TrajectoryWriter, TrajectoryReader, replay
+from src.checkpoint import Checkpointer, load
+from src.tiles import TiledUniverse
 
 
 if __name__ == "__main__":
@@ -18,10 +26,19 @@ if __name__ == "__main__":
                         type=float,
                         default=30.0,
                         help="the (maximum) framerate")
+    parser.add_argument("--tick-rate",
+                        dest="tick_rate",
+                        type=float,
+                        default=None,
+                        help="the fixed simulation rate in ticks per simulated second, independent of the framerate, e.g. 120 (defaults to the framerate)")
     parser.add_argument("--res",
                         type=str,
                         default="1920x1080",
                         help="the resolution")
+    parser.add_argument("--seed",
+                        type=int,
+                        default=None,
+                        help="seed for all randomness, to reproduce a run")
     parser.add_argument("--highlight",
                         action="store_true",
                         help="highlight a single fosh")
@@ -29,6 +46,68 @@ if __name__ == "__main__":
                         dest="preview_only",
                         action="store_true",
                         help="dont save the video, just show the preview")
+    parser.add_argument("--record-policy",
+                        dest="record_policy",
+                        choices=RECORD_POLICIES,
+                        default="block",
+                        help="what to do with new frames when the video encoder falls behind: wait for it, drop them or spill them to disk")
+    parser.add_argument("--sprites",
+                        action="store_true",
+                        help="draw the foshs from a pre-rendered sprite atlas, which is faster for schools of thousands of foshs (overlapping foshs merge into one shape)")
+    parser.add_argument("--bands",
+                        type=int,
+                        default=1,
+                        help="draw the foshs and food in BANDS horizontal bands of the frame, on a thread each (the pixels are the same), for large resolutions; not with --sprites")
+    parser.add_argument("--concurrent",
+                        action="store_true",
+                        help="simulate the next frame on a worker thread while the current one is drawn")
+    parser.add_argument("--profile",
+                        nargs="?",
+                        const="profile.json",
+                        default=None,
+                        help="time each phase of the ticks and frames and write the percentiles to PROFILE on exit, as csv if it ends in .csv (defaults to profile.json)")
+    parser.add_argument("--profile-hud",
+                        dest="profile_hud",
+                        action="store_true",
+                        help="with --profile, also draw the timings onto the frames")
+    parser.add_argument("--headless",
+                        action="store_true",
+                        help="dont open a window or render anything, just simulate as fast as possible")
+    parser.add_argument("--ticks",
+                        type=int,
+                        default=None,
+                        help="stop after this many ticks and report the achieved ticks/sec")
+    parser.add_argument("--trajectory",
+                        default=None,
+                        help="record the state after every tick to the file TRAJECTORY, to --replay it later")
+    parser.add_argument("--replay",
+                        default=None,
+                        help="render a recorded trajectory instead of simulating (with --headless, only into the video)")
+    parser.add_argument("--start",
+                        type=int,
+                        default=0,
+                        help="with --replay, the first tick of the trajectory to render")
+    parser.add_argument("--stop",
+                        type=int,
+                        default=None,
+                        help="with --replay, the tick of the trajectory to stop before")
+    parser.add_argument("--checkpoint",
+                        default=None,
+                        help="save the whole state to the .npz file CHECKPOINT every --checkpoint-every ticks and on exit, to --resume from later ({tick} in the name keeps every checkpoint)")
+    parser.add_argument("--checkpoint-every",
+                        dest="checkpoint_every",
+                        type=int,
+                        default=1000,
+                        help="the number of ticks between two checkpoints")
+    parser.add_argument("--tiles",
+                        nargs="?",
+                        type=int,
+                        const=0,
+                        default=None,
+                        help="split the tank into TILES strips, each simulated by a worker process (defaults to one per core), for very large schools; only with --dist")
+    parser.add_argument("--resume",
+                        default=None,
+                        help="continue from a checkpoint instead of starting a new tank (its settings replace the ones given)")
 
     # weights
     parser.add_argument("-c", "--cohesion",
@@ -55,6 +134,17 @@ if __name__ == "__main__":
                         default="avoid",
                         help="the behaviour of the foshs near edges, either avoid them or just wrap around to the other side")
 
+    parser.add_argument("--skin",
+                        type=float,
+                        default=20.0,
+                        help="with --dist, cache the foshs within DIST + SKIN and only search again once they moved far enough, 0 to search every tick")
+
+    parser.add_argument("--crowding-resolution",
+                        dest="crowding_resolution",
+                        type=int,
+                        default=None,
+                        help="look the crowding up in a density field with CROWDING_RESOLUTION cells per crowding radius instead of counting exactly, which is much faster for large schools but turns the crowded foshs a median 12-20 degrees off at 8 and 5 at 32")
+
     # what method to use to decide which foshs are close ('nearby')
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--dist",
@@ -68,23 +158,112 @@ if __name__ == "__main__":
                        type=int,
                        const=DEFAULT_NUM_NEIGHBORS,
                        help=f"the COUNT closest foshs are seen by the current fosh (defaults to {DEFAULT_NUM_NEIGHBORS})")
+    group.add_argument("--field",
+                       dest="field_resolution",
+                       nargs="?",
+                       type=int,
+                       const=8,
+                       help="approximate the foshs within the view distance on a grid with FIELD_RESOLUTION nodes per view distance (defaults to 8), for very large schools")
     
     args = parser.parse_args()
+    if args.bands > 1 and args.sprites:
+        parser.error("--bands does not work with --sprites, sprites are always blitted on one thread")
+    if args.resume and args.trajectory and exists(args.trajectory):
+        parser.error(f"{args.trajectory} already exists, record the resumed run to a new trajectory")
+    if args.tiles is not None and (args.num_neighbors or args.field_resolution):
+        parser.error("--tiles only works with --dist")
+
+    profiler = Profiler(hud=args.profile_hud) if args.profile else None
+    res = args.res.split("x")
+
+    if args.replay:
+        # replay a trajectory, one frame per 1 / fps of simulated time
+        reader = TrajectoryReader(args.replay)
+        canvas = Canvas(res,
+                        args.fps,
+                        video=not args.preview_only,
+                        sprites=args.sprites,
+                        bands=args.bands,
+                        record_policy=args.record_policy,
+                        profiler=profiler,
+                        show=not args.headless)
+        step = max(1, round(1 / (reader.dt * args.fps)))
+
+        with canvas:
+            start = perf_counter()
+            try:
+                frames = replay(reader,
+                                canvas,
+                                reader.record_of(args.start),
+                                None if args.stop is None else reader.record_of(args.stop),
+                                step)
+            except KeyboardInterrupt:
+                frames = 0
+            elapsed = perf_counter() - start
+        print(f"replayed {frames} frames of {len(reader)} ticks in {elapsed:.2f}s")
+        raise SystemExit
 
     # run simulation
-    with Canvas(args.res.split("x"), args.fps) as canvas:
-        u = Universe(canvas,
+    if args.headless:
+        canvas = NullCanvas(res, args.fps)
+    else:
+        canvas = Canvas(res,
+                        args.fps,
+                        video=not args.preview_only,
+                        sprites=args.sprites,
+                        bands=args.bands,
+                        record_policy=args.record_policy,
+                        profiler=profiler)
+
+    with canvas:
+        # with --tiles, the foshs are turned and moved by worker processes
+        universe = Universe if args.tiles is None else partial(TiledUniverse, tiles=args.tiles or None)
+        u = universe(canvas,
                      edge_behaviour=args.edge_behaviour,
-                     nearby_method="dist" if args.num_neighbors is None else "count",
+                     nearby_method="count" if args.num_neighbors else "field" if args.field_resolution else "dist",
                      view_dist=args.dist or DEFAULT_VIEW_DIST,
+                     skin=args.skin,
                      num_neighbors=args.num_neighbors or DEFAULT_NUM_NEIGHBORS,
+                     field_resolution=args.field_resolution or 8,
+                     crowding_resolution=args.crowding_resolution,
                      sep=args.sep,
                      align=args.align,
-                     cohes=args.cohes)
+                     cohes=args.cohes,
+                     dt=None if args.tick_rate is None else 1 / args.tick_rate,
+                     profiler=profiler,
+                     seed=args.seed)
+
+        if args.resume:
+            u.restore(load(args.resume))
+        else:
+            if args.highlight:
+                u.add_fosh(color=PALETTE["highlight"], pos=(0, 0))
+                args.n -= 1
+            u.populate(args.n)
 
-        if args.highlight:
-            u.add_fosh(color=PALETTE["highlight"], pos=(0, 0))
-            args.n -= 1
+        if args.trajectory:
+            u.trajectory = TrajectoryWriter(args.trajectory, u.dt, u.size)
+        if args.checkpoint:
+            u.checkpoints = Checkpointer(args.checkpoint, args.checkpoint_every)
 
-        u.populate(args.n)
-        u.loop()
+        start, first_tick = perf_counter(), u.tick_count
+        try:
+            u.loop(args.ticks, concurrent=args.concurrent)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if u.trajectory is not None:
+                u.trajectory.close()
+            if u.checkpoints is not None:
+                u.checkpoints.save(u.tick_count, u.state())
+                u.checkpoints.close()
+            if isinstance(u, TiledUniverse):
+                u.close()
+        elapsed = perf_counter() - start
+        ticks = u.tick_count - first_tick
+        print(f"{ticks} ticks in {elapsed:.2f}s ({ticks / elapsed:.1f} ticks/sec)")
+        if u.pacer is not None:
+            print(u.pacer.report())
+        if profiler is not None:
+            profiler.dump(args.profile)
+            print(f"wrote profile to {args.profile}")
@@ -0,0 +1,119 @@
+from src import PALETTE
+from src.canvas import NullCanvas
+from src.grid import SpatialGrid
+from src.universe import Universe
+import json
+import numpy as np
+
+
+# Universe arguments of the weights -> keys of Universe.weights
+WEIGHTS = {"sep": "seperation", "align": "alignment", "cohes": "cohesion", "food_weight": "food"}
+
+
+class BatchUniverse(Universe):
+    """
+    K independent tanks simulated together, for parameter sweeps. The foshs of
+    all tanks live in one swarm, tank after tank, so every step of a tick
+    covers all tanks at once. The grids and the food are keyed by tank
+    (`groups`), so foshs never see, crowd or eat across tanks.
+
+    Tanks share the size, dt and all other settings, and differ only by their
+    weights (a dict of sep/align/cohes/food_weight per tank, missing ones fall
+    back to the keyword arguments) and their seeds. Tank k runs like
+    Universe(seed=seeds[k], **weights[k]), up to rounding.
+    """
+    def __init__(self, weights, seeds=None, **kwargs):
+        super().__init__(NullCanvas(), **kwargs)
+        self.tanks = len(weights)
+        self.rngs = [np.random.default_rng(seed) for seed in (range(self.tanks) if seeds is None else seeds)]
+        self.tank_weights = {key: np.array([w.get(arg, self.weights[key]) for w in weights], dtype="float")
+                             for arg, key in WEIGHTS.items()}
+        self.groups = np.empty(0, dtype="int")
+        self.eaten = np.zeros(self.tanks, dtype="int")  # food eaten so far, per tank
+
+    def populate(self, n):
+        """
+        Fills every tank with n foshs. Can only be called once, the tanks need
+        to be laid out one after another in the swarm.
+        """
+        if len(self.swarm):
+            raise RuntimeError("a batch can only be populated once")
+        accents = np.array(PALETTE["accents"], dtype="uint8")
+        for rng in self.rngs:
+            # same draws as Universe.populate
+            colors = accents[rng.integers(len(accents), size=n)]
+            positions = self.size * (1 - 2 * rng.random((n, 2)))
+            angles = np.trunc(2 * np.pi * rng.random(n))
+            self.swarm.add(colors, positions, angles)
+        self.groups = np.repeat(np.arange(self.tanks), n)
+
+        # one weight per fosh, as a column to broadcast against the direction vectors
+        self.weights = {key: w[self.groups][:, None] for key, w in self.tank_weights.items()}
+
+    def spawn_food(self):
+        for k, rng in enumerate(self.rngs):
+            position = self._food_position(rng, self.swarm.positions[self.groups == k])
+            self.food.sprinkle(position, 50, self.food_spawn_chance, rng, group=k)
+
+    def check_food_consumption(self):
+        eaters = super().check_food_consumption()
+        self.eaten += np.bincount(self.groups[eaters], minlength=self.tanks)
+        return eaters
+
+    def metrics(self):
+        """
+        Summarizes the current state of every tank, each as an array with a
+        value per tank:
+            polarization: length of the mean heading, 1 if all foshs swim the same way
+            speed: mean speed
+            nearest: mean distance to the nearest other fosh
+            eaten: food eaten so far
+        """
+        n = len(self.swarm) // self.tanks
+        positions = self.swarm.positions
+
+        area_per_fosh = np.prod(2 * self.size) / max(n, 1)
+        grid = SpatialGrid(positions, np.sqrt(2 * area_per_fosh / 9), self.size, wrap=self.edge_behaviour == "wrap", groups=self.groups)
+        nearest = grid.knn(1)
+        if nearest.shape[1]:
+            dist = np.linalg.norm(self._displacement(positions, positions[nearest[:, 0]]), axis=-1)
+        else:
+            dist = np.zeros(len(positions))
+
+        return {
+            "polarization": np.linalg.norm(self.swarm.dirs.reshape(self.tanks, n, 2).mean(axis=1), axis=-1),
+            "speed": self.swarm.speeds.reshape(self.tanks, n).mean(axis=1),
+            "nearest": dist.reshape(self.tanks, n).mean(axis=1),
+            "eaten": self.eaten.copy(),
+        }
+
+    def config(self):
+        # the weights are per fosh, the state keeps them per tank instead
+        config = super().config()
+        del config["weights"]
+        return config
+
+    def state(self):
+        """
+        Returns the state of a Universe, plus the weights, generators and
+        eaten food of every tank and the tank of every fosh.
+        """
+        state = super().state()
+        state.update({f"tank_weights_{key}": w.copy() for key, w in self.tank_weights.items()})
+        state.update({
+            "groups": self.groups.copy(),
+            "eaten": self.eaten.copy(),
+            "rngs": np.array(json.dumps([rng.bit_generator.state for rng in self.rngs])),
+        })
+        return state
+
+    def restore(self, state):
+        super().restore(state)
+        self.tank_weights = {key: np.array(state[f"tank_weights_{key}"], dtype="float") for key in WEIGHTS.values()}
+        self.tanks = len(self.tank_weights["seperation"])
+        self.groups = np.array(state["groups"], dtype="int")
+        self.weights = {key: w[self.groups][:, None] for key, w in self.tank_weights.items()}
+        self.eaten = np.array(state["eaten"], dtype="int")
+        self.rngs = [np.random.default_rng() for _ in range(self.tanks)]
+        for rng, rng_state in zip(self.rngs, json.loads(str(state["rngs"]))):
+            rng.bit_generator.state = rng_state
@@ -0,0 +1,192 @@
+"""
+Scaling benchmarks for the simulation and the renderer.
+
+    python -m src.bench                                # run all cases, write out/bench.json
+    python -m src.bench --save-baseline bench.json     # ... and store them as the baseline
+    python -m src.bench --baseline bench.json          # ... and compare against it
+
+Every case runs headless Universe ticks and Canvas draws (into an
+off-screen canvas) for one combination of the number of foshs, the
+nearby method, the edge behaviour and whether there is food. Above
+EXACT_CROWDING_MAX foshs, crowding is looked up in a density field
+instead of counted exactly, which would take minutes and gigabytes per
+tick. The results are written after every case, a case running out of
+memory is recorded as such. Comparing against a baseline exits with
+status 1 if any case got slower by more than the tolerance.
+"""
+from argparse import ArgumentParser
+from itertools import product
+from time import perf_counter
+import json
+import platform
+import tracemalloc
+import numpy as np
+from src import OUT_DIR
+from src import Universe, Canvas, NullCanvas
+from src.results import write_results
+
+
+SIZES = (50, 500, 5000, 50000)
+NEARBY_METHODS = ("dist", "count", "field")
+EDGE_BEHAVIOURS = ("avoid", "wrap")
+FOOD = (False, True)
+RES = (1920, 1080)
+# cases with more foshs look crowding up at this resolution, see Universe.get_crowding
+EXACT_CROWDING_MAX = 5000
+CROWDING_RESOLUTION = 8
+
+
+def _key(case):
+    key = f"n={case['n']} {case['nearby_method']} {case['edge_behaviour']} {'food' if case['food'] else 'no food'}"
+    if case.get("crowding_resolution"):
+        key += f" crowding={case['crowding_resolution']}"
+    return key
+
+
+def _case(n, nearby_method, edge_behaviour, food):
+    return {"n": n, "nearby_method": nearby_method, "edge_behaviour": edge_behaviour, "food": food,
+            "crowding_resolution": CROWDING_RESOLUTION if n > EXACT_CROWDING_MAX else None}
+
+
+def make_universe(n, nearby_method, edge_behaviour, food, canvas, seed=0, crowding_resolution=None):
+    u = Universe(canvas,
+                 nearby_method=nearby_method,
+                 edge_behaviour=edge_behaviour,
+                 food_spawn_interval=1 if food else np.inf,
+                 seed=seed,
+                 crowding_resolution=crowding_resolution)
+    u.populate(n)
+    if food:
+        for _ in range(5):
+            u.spawn_food()
+    return u
+
+
+def _time(f, count, max_seconds):
+    """
+    Calls f up to count times (but at least once) within max_seconds, returns
+    the duration of each call. Cases are compared by the median, which is
+    robust against the odd slow call.
+    """
+    times, start = [], perf_counter()
+    while len(times) < count and (not times or perf_counter() - start < max_seconds):
+        before = perf_counter()
+        f()
+        times.append(perf_counter() - before)
+    return times
+
+
+def run_case(n, nearby_method, edge_behaviour, food, ticks, frames, max_seconds):
+    case = _case(n, nearby_method, edge_behaviour, food)
+
+    # simulation, as fast as possible
+    u = make_universe(n, nearby_method, edge_behaviour, food, NullCanvas(RES), crowding_resolution=case["crowding_resolution"])
+    u.tick()  # warm up
+    case["ticks"] = len(times := _time(u.tick, ticks, max_seconds))
+    case["ms_per_tick"] = 1000 * np.median(times)
+    case["ticks_per_sec"] = 1 / np.median(times)
+
+    # rendering into an off-screen canvas, without showing or encoding
+    canvas = Canvas(RES, 30, show=False)
+    u.canvas = canvas
+    u.draw()  # warm up
+    case["ms_per_frame"] = 1000 * np.median(_time(u.draw, frames, max_seconds))
+
+    # peak memory of a tick and a frame, traced separately as tracing slows things down
+    tracemalloc.start()
+    u.tick()
+    u.draw()
+    case["peak_mem_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return case
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints how each case compares to the baseline, returns the keys of the
+    cases that got slower by more than tolerance.
+    """
+    base = {_key(case): case for case in baseline["results"]}
+    regressions = []
+    for case in results:
+        key = _key(case)
+        if "error" in case or "error" in base.get(key, {}):
+            print(f"{key:<44} (failed)")
+            continue
+        if key not in base:
+            print(f"{key:<44} (not in baseline)")
+            continue
+        tick_ratio = case["ticks_per_sec"] / base[key]["ticks_per_sec"]
+        frame_ratio = base[key]["ms_per_frame"] / case["ms_per_frame"]
+        slower = tick_ratio < 1 - tolerance or frame_ratio < 1 - tolerance
+        print(f"{key:<44} ticks {tick_ratio:6.2f}x  frames {frame_ratio:6.2f}x{'  REGRESSION' if slower else ''}")
+        if slower:
+            regressions.append(key)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="scaling benchmarks for the simulation and the renderer")
+    parser.add_argument("--sizes",
+                        type=int,
+                        nargs="+",
+                        default=SIZES,
+                        help=f"the numbers of foshs to benchmark (defaults to {' '.join(map(str, SIZES))})")
+    parser.add_argument("--ticks",
+                        type=int,
+                        default=50,
+                        help="the number of ticks to time per case")
+    parser.add_argument("--frames",
+                        type=int,
+                        default=20,
+                        help="the number of frames to time per case")
+    parser.add_argument("--max-seconds",
+                        dest="max_seconds",
+                        type=float,
+                        default=10.0,
+                        help="stop timing the ticks (or frames) of a case after this long")
+    parser.add_argument("-o", "--output",
+                        default=OUT_DIR + "bench.json",
+                        help="where to write the results")
+    parser.add_argument("--baseline",
+                        help="compare the results against this file")
+    parser.add_argument("--save-baseline",
+                        dest="save_baseline",
+                        help="also write the results to this file, to compare later runs against")
+    parser.add_argument("--tolerance",
+                        type=float,
+                        default=0.2,
+                        help="how much slower than the baseline a case may get before it is a regression")
+    args = parser.parse_args()
+
+    results = []
+    data = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+    for n, nearby_method, edge_behaviour, food in product(args.sizes, NEARBY_METHODS, EDGE_BEHAVIOURS, FOOD):
+        try:
+            case = run_case(n, nearby_method, edge_behaviour, food, args.ticks, args.frames, args.max_seconds)
+            print(f"{_key(case):<44} {case['ticks_per_sec']:9.1f} ticks/sec {case['ms_per_frame']:8.2f} ms/frame {case['peak_mem_mb']:8.1f} MB peak")
+        except MemoryError:
+            tracemalloc.stop()  # in case it ran out while tracing
+            case = {**_case(n, nearby_method, edge_behaviour, food), "error": "out of memory"}
+            print(f"{_key(case):<44} out of memory")
+        results.append(case)
+
+        # written after every case, so a run that dies still leaves the cases before
+        write_results(args.output, data)
+        if args.save_baseline:
+            write_results(args.save_baseline, data)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s)")
+            raise SystemExit(1)
@@ -1,26 +1,53 @@
-from src import SCALE, OUT_DIR
+from src import SCALE, OUT_DIR, FOSH_SIZE
+from src.fosh import tails
+from src.sprites import SpriteAtlas
+from src.recorder import Recorder
+from src.frames import FramePool
+from src.profiler import NullProfiler
+from concurrent.futures import ThreadPoolExecutor
+from os import makedirs
 from time import strftime, localtime
 import cv2
 import numpy as np
 
 
 TRANSLATION = np.array((SCALE, -SCALE))  # y coord is negative as the y axis is in downward direction in images
+AA_PX = 2  # how far antialiasing may reach beyond a shape's rows
 
 
 class Canvas():
-    def __init__(self, res, fps, video = False):
+    headless = False
+
+    def __init__(self, res, fps, video = False, sprites = False, record_policy = "block", profiler = None, show = True, bands = 1):
         # output related
         self.res = np.array(res, dtype="int")
         self.fps = float(fps)
-        self.current_frame = self.new_frame()
+        self.show = show  # without a preview window, frames are only drawn (and recorded)
         self.closed = False
+        self.profiler = profiler or NullProfiler()
+
+        # frames are reused instead of allocated every update, and two of them
+        # make a double buffer: the last shown frame stays intact while the next
+        # one is drawn
+        self.frames = FramePool((*self.res[::-1], 3), 2)
+        self.current_frame = self.frames.acquire()
+        self.background = None
+
+        # pre-rendered foshs, drawn by blitting instead of rasterizing each one
+        self.atlas = SpriteAtlas() if sprites else None
+
+        # the foshs can be drawn in horizontal bands of the frame, one thread each
+        self.bands = max(1, min(int(bands), self.res[1]))
+        self.pool = ThreadPoolExecutor(self.bands, thread_name_prefix="fosh-band") if self.bands > 1 else None
 
         # renderer
         self.filename = OUT_DIR + strftime('%Y%m%dT%H%M%S', localtime()) + ".mp4"
         self.title = f"foshs - Preview - {self.filename}"
         
         if video:
-            self.video = VideoWriter(self.filename, FourCC(*"mp4v"), int(self.fps), tuple(self.res))
+            # encodes on its own thread, so update only pays for a copy of the frame
+            makedirs(OUT_DIR, exist_ok=True)
+            self.video = Recorder(self.filename, self.fps, self.res, policy=record_policy)
         else:
             self.video = None
      
@@ -28,11 +55,15 @@ class Canvas():
         return self
 
     def __exit__(self, *args, **kwargs):
-        cv2.destroyWindow(self.title)
-        
+        if self.show:
+            cv2.destroyWindow(self.title)
+
         if self.video is not None:
             self.video.release()
 
+        if self.pool is not None:
+            self.pool.shutdown()
+
     @property
     def size(self):
         return np.abs(self.from_px(self.res))
@@ -49,17 +80,42 @@ class Canvas():
     def new_frame(self):
         return np.ndarray(shape=(*self.res[::-1], 3), dtype="uint8")
 
-    def update(self):
+    def update(self, wait=None):
+        """
+        Shows (and records) the current frame and starts a new one. Waits up to
+        wait seconds for key presses, a full frame interval if not given.
+        """
         if self.video is not None:
-            self.video.write(self.current_frame)
-        cv2.imshow(self.title, self.current_frame)
-        self.current_frame = self.new_frame()
+            with self.profiler.phase("encode"):
+                self.video.write(self.current_frame)
+        if self.show:
+            with self.profiler.phase("imshow"):
+                cv2.imshow(self.title, self.current_frame)
+        self.frames.release(self.current_frame)
+        self.current_frame = self.frames.acquire()
+        if not self.show:
+            return
+
+        # waitKey(0) would wait forever, so always wait at least 1ms
+        wait_ms = max(1, int(1000 * (1 / self.fps if wait is None else wait)))
 
         # set to true if window-x or {esc, ctrl-c, q} pressed
-        self.closed |= (cv2.getWindowProperty(self.title, 0) < 0) or (cv2.waitKey(int(1000 / self.fps)) in {27, 2, 3, ord("q"), ord("Q")})
+        with self.profiler.phase("wait"):
+            self.closed |= (cv2.getWindowProperty(self.title, 0) < 0) or (cv2.waitKey(wait_ms) in {27, 2, 3, ord("q"), ord("Q")})
 
     def fill(self, color):
-        self.current_frame[:, :] = np.array(color, dtype="uint8")
+        # clearing is a plain copy from a cached frame in the background color
+        if self.background is None or (self.background[0, 0] != color).any():
+            self.background = self.new_frame()
+            self.background[:, :] = np.array(color, dtype="uint8")
+        np.copyto(self.current_frame, self.background)
+
+    def draw_text(self, lines, color=(0xff, 0xff, 0xff)):
+        """
+        Writes lines of text into the top left corner of the frame.
+        """
+        for i, line in enumerate(lines):
+            cv2.putText(self.current_frame, line, (10, 20 + 18 * i), cv2.FONT_HERSHEY_PLAIN, 1.0, color, 1, cv2.LINE_AA)
 
     def draw_poly(self, points, color):
         cv2.fillPoly(self.current_frame,
@@ -69,3 +125,135 @@ class Canvas():
     
     def draw_circle(self, size, pos, color):
         cv2.circle(self.current_frame, self.to_px(pos), size, color, -1)
+
+    def draw_polys(self, polys, color):
+        """
+        Fills all polygons of an (m, k, 2) array with one color, in a single
+        call (per band, with several bands).
+        """
+        if len(polys) == 0:
+            return
+        px = self.to_px(polys).astype("int32")
+
+        def fill(frame, offset, inside):
+            cv2.fillPoly(frame, px[inside] - (0, offset), color, 16)
+
+        self._banded(px[:, :, 1].min(axis=1), px[:, :, 1].max(axis=1), None, fill)
+
+    def draw_foshs(self, positions, angles, colors):
+        """
+        Draws all foshs, either as sprites from the atlas or with one polygon
+        call per color for the tails. With several bands, the tails of each
+        band of the frame are filled on a thread of their own (see _banded),
+        into the same pixels.
+        """
+        px = self.to_px(positions)
+        if self.atlas is not None:
+            # a few array operations over all foshs at once, on this thread
+            self.atlas.blit(self.current_frame, px, angles, colors)
+            return
+
+        palette, groups = np.unique(colors, axis=0, return_inverse=True)
+        groups = groups.ravel()
+        polys = self.to_px(tails(positions, angles)).astype("int32")
+
+        def bodies(frame, offset, inside):
+            for center, color in zip((px[inside] - (0, offset)).tolist(), colors[inside].tolist()):
+                cv2.circle(frame, center, FOSH_SIZE, color, -1)
+
+        def fins(frame, offset, inside):
+            for i, color in enumerate(palette.tolist()):
+                shapes = polys[inside & (groups == i)]
+                if len(shapes):
+                    cv2.fillPoly(frame, shapes - (0, offset), color, 16)
+
+        lows = np.minimum(px[:, 1] - FOSH_SIZE, polys[:, :, 1].min(axis=1))
+        highs = np.maximum(px[:, 1] + FOSH_SIZE, polys[:, :, 1].max(axis=1))
+        self._banded(lows, highs, bodies, fins)
+
+    def _banded(self, lows, highs, loop, fill):
+        """
+        Draws shapes in bands of rows of the current frame, first with
+        loop(frame, offset, inside) and then with fill(frame, offset, inside):
+        inside masks the shapes which reach into the band (lows and highs being
+        the first and last row of each shape), and frame is a copy of the band
+        with enough rows around it for the tallest shape, starting at row
+        offset of the current frame.
+
+        loop (if given) is meant for python loops over the shapes and runs band
+        after band on this thread (on the pool, it would only fight over the GIL).
+        Each band's fill (a few big opencv calls, which release the GIL) then
+        runs on the pool while loop goes on with the next band.
+
+        Every shape is drawn whole into the copy, so it is clipped exactly as
+        on the whole frame, and only the band's own rows are copied back. The
+        pixels are the same as drawing all shapes into the frame at once.
+        """
+        if self.pool is None:
+            everything = np.ones(len(lows), dtype="bool")
+            if loop is not None:
+                loop(self.current_frame, 0, everything)
+            fill(self.current_frame, 0, everything)
+            return
+
+        height = self.res[1]
+        margin = int(np.max(highs - lows, initial=0)) + 2 * AA_PX
+
+        # all bands copy their rows before any of them writes back
+        edges = np.linspace(0, height, self.bands + 1).astype("int").tolist()
+        bands = []
+        for top, bottom in zip(edges[:-1], edges[1:]):
+            inside = (highs >= top - AA_PX) & (lows < bottom + AA_PX)
+            if inside.any():
+                start = max(top - margin, 0)
+                bands.append((top, bottom, start, inside, self.current_frame[start:min(bottom + margin, height)].copy()))
+
+        def finish(top, bottom, start, inside, frame):
+            fill(frame, start, inside)
+            self.current_frame[top:bottom] = frame[top - start:bottom - start]
+
+        futures = []
+        for top, bottom, start, inside, frame in bands:
+            if loop is not None:
+                loop(frame, start, inside)
+            futures.append(self.pool.submit(finish, top, bottom, start, inside, frame))
+        for future in futures:
+            future.result()
+
+
+class NullCanvas(Canvas):
+    """
+    A canvas which never shows or draws anything, for running universes on
+    machines without a display, as fast as possible.
+    """
+    headless = True
+
+    def __init__(self, res=(1920, 1080), fps=30.0):
+        self.res = np.array(res, dtype="int")
+        self.fps = float(fps)
+        self.closed = False
+        self.video = None
+
+    def __exit__(self, *args, **kwargs):
+        pass
+
+    def update(self, wait=None):
+        pass
+
+    def fill(self, color):
+        pass
+
+    def draw_poly(self, points, color):
+        pass
+
+    def draw_circle(self, size, pos, color):
+        pass
+
+    def draw_text(self, lines, color=(0xff, 0xff, 0xff)):
+        pass
+
+    def draw_polys(self, polys, color):
+        pass
+
+    def draw_foshs(self, positions, angles, colors):
+        pass
@@ -0,0 +1,52 @@
+from os import replace
+import queue
+import threading
+import numpy as np
+
+
+def save(path, state):
+    """
+    Writes a state (a dict of arrays) to an uncompressed .npz file. The file
+    is written next to path and then moved over it, so a crash while saving
+    never leaves a broken checkpoint behind.
+    """
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **state)
+    replace(path + ".tmp", path)
+
+
+def load(path):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+class Checkpointer():
+    """
+    Saves a universe's state every `every` ticks, on a background thread.
+
+    The tick only pays for copying the state, writing it happens in the
+    background. If the previous checkpoint is still being written, the next
+    one waits for it. path may contain {tick}, to keep every checkpoint
+    instead of overwriting the last one.
+    """
+    def __init__(self, path, every=1000):
+        self.path = path
+        self.every = every
+        self.saved = 0
+
+        self.pending = queue.Queue(maxsize=1)  # (tick, state), None to stop
+        self.thread = threading.Thread(target=self._save, name="fosh-checkpointer", daemon=True)
+        self.thread.start()
+
+    def save(self, tick, state):
+        self.pending.put((tick, state))
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+    def _save(self):
+        while (item := self.pending.get()) is not None:
+            tick, state = item
+            save(self.path.format(tick=tick), state)
+            self.saved += 1
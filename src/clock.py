@@ -0,0 +1,10 @@
+class Clock():
+    """
+    Simulation time in seconds. It only moves when the universe ticks, so
+    everything timed by it behaves the same no matter how fast the ticks run.
+    """
+    def __init__(self, now=0.0):
+        self.now = float(now)
+
+    def advance(self, dt):
+        self.now += dt
@@ -0,0 +1,245 @@
+from src.grid import wrapped
+import numpy as np
+
+
+class DensityField():
+    """
+    Number and center of mass of the points within radius of each point,
+    approximated on a grid.
+
+    The points are binned into cells of radius / resolution, with one
+    bincount for the counts and one per axis for the position sums. Each point
+    then sums the cells whose centers are within radius of its own cell's
+    center, a disk of cells. With prefix sums along every row of cells, each
+    row of the disk is a single lookup, so a point costs 2 * resolution + 1
+    lookups no matter how many points are around it.
+
+    The disk is centered on the point's cell rather than the point, so points
+    up to half a cell beyond radius may be counted and ones inside missed;
+    a higher resolution makes the cells (and that error) smaller.
+
+    Like SpatialGrid, with wrap=True the grid is a torus, and with groups
+    every group gets a grid of its own.
+
+    Without wrapping, bounds (the lowest and highest corner of all points) can
+    be given instead of taken from the points, so fields over different
+    subsets of the same points share the same cells.
+    """
+    def __init__(self, positions, radius, size, wrap=False, groups=None, resolution=4, bounds=None):
+        self.positions = np.asarray(positions, dtype="float")
+        self.size = np.asarray(size, dtype="float")
+        self.wrap = wrap
+        self.groups = np.zeros(len(self.positions), dtype="int") if groups is None else np.asarray(groups, dtype="int")
+        group_count = int(self.groups.max(initial=0)) + 1
+
+        # without wrapping, the grid grows by whole cells to cover points which
+        # left the tank, the cells themselves stay put
+        cell_size = radius / resolution
+        if wrap:
+            self.origin = -self.size
+            self.shape = np.maximum((2 * self.size // cell_size).astype("int"), 1)
+            self.cell_size = 2 * self.size / self.shape
+        else:
+            low, high = (self.positions.min(axis=0, initial=0), self.positions.max(axis=0, initial=0)) if bounds is None else bounds
+            below = np.maximum(-self.size - low, 0)
+            self.origin = -self.size - np.ceil(below / cell_size) * cell_size
+            end = np.maximum(self.size, high)
+            self.shape = np.maximum(np.ceil((end - self.origin) / cell_size).astype("int"), 1)
+            self.cell_size = np.full(2, cell_size)
+
+        # the disk, as the half width of each of its rows (all in cells); on a
+        # small torus it must not reach around to the same cell twice
+        reach = radius / self.cell_size
+        self.rows = np.arange(-int(reach[1]), int(reach[1]) + 1)
+        self.widths = np.floor(reach[0] * np.sqrt(np.maximum(1 - (self.rows / reach[1])**2, 0))).astype("int")
+        if wrap:
+            keep = np.abs(self.rows) <= (self.shape[1] - 1) // 2
+            self.rows, self.widths = self.rows[keep], np.minimum(self.widths[keep], (self.shape[0] - 1) // 2)
+        self.pad = np.array([self.widths.max(), np.abs(self.rows).max()])
+
+        # with wrapping, the points are taken into the tank first, so positions
+        # and cells agree
+        self.points = wrapped(self.positions, self.size) if wrap else self.positions
+        cells = np.floor((self.points - self.origin) / self.cell_size).astype("int")
+        self.cells = cells % self.shape if wrap else np.clip(cells, 0, self.shape - 1)
+
+        width, height = self.shape
+        flat = (self.groups * height + self.cells[:, 1]) * width + self.cells[:, 0]
+        # (as floats, bincount of no points at all gives ints)
+        grids = [np.bincount(flat, weights=weights, minlength=group_count * width * height).reshape(group_count, height, width).astype("float")
+                 for weights in (None, self.points[:, 0], self.points[:, 1])]
+
+        # pad the grids so the disk never leaves them
+        px, py = self.pad
+        pad = ((0, 0), (py, py), (px, px))
+        if wrap:
+            count, sum_x, sum_y = (np.pad(grid, pad, mode="wrap") for grid in grids)
+            # cells copied over from the other side are one tank width away
+            if px:
+                sum_x[:, :, :px] -= 2 * self.size[0] * count[:, :, :px]
+                sum_x[:, :, -px:] += 2 * self.size[0] * count[:, :, -px:]
+            if py:
+                sum_y[:, :py] -= 2 * self.size[1] * count[:, :py]
+                sum_y[:, -py:] += 2 * self.size[1] * count[:, -py:]
+        else:
+            count, sum_x, sum_y = (np.pad(grid, pad) for grid in grids)
+
+        # prefix sums along each row, with a leading column of zeros
+        self.tables = []
+        for grid in (count, sum_x, sum_y):
+            table = np.zeros((group_count, grid.shape[1], grid.shape[2] + 1))
+            table[:, :, 1:] = grid.cumsum(axis=2)
+            self.tables.append(table)
+
+    def lookup(self):
+        """
+        Returns the number of points within radius of each point (the point
+        itself included), and their center of mass.
+        """
+        x, y = (self.cells + self.pad).T
+        g = self.groups
+        count, sum_x, sum_y = (np.zeros(len(self.positions)) for _ in range(3))
+        for row, half in zip(self.rows, self.widths):
+            for total, table in zip((count, sum_x, sum_y), self.tables):
+                total += table[g, y + row, x + half + 1] - table[g, y + row, x - half]
+
+        center = np.stack((sum_x, sum_y), axis=-1) / count[:, None]
+        # relative to each point's own position, in case it was wrapped into the tank
+        return np.round(count).astype("int"), self.positions + (center - self.points)
+
+
+class FlockingField():
+    """
+    Particle-mesh approximation of the flocking sums over all points within
+    radius of each point: the sum of the offsets to them (cohesion), of
+    their headings (alignment), and of offset / distance^2 away from them
+    (separation).
+
+    The points and their headings are deposited onto the nodes of a grid with
+    spacing h = radius / resolution, each onto the 4 nodes around it with
+    bilinear (cloud in cell) weights. The deposits are smoothed by convolving
+    them (with FFTs) with a kernel per sum over all node offsets within
+    radius, and each point reads the smoothed fields back with the same
+    weights. The point's own deposit is subtracted again, so a point never
+    counts itself. The cost is O(n + cells log cells), whatever the density.
+
+    Error bounds, with d the distance between two points, all following from
+    every point being within sqrt(2) * h of the nodes it is spread over:
+        - pairs with d < radius - 2 sqrt(2) h are counted exactly in the
+          cohesion and alignment sums (the bilinear weights reproduce the
+          offsets exactly), pairs with d >= radius + 2 sqrt(2) h not at all,
+          and pairs in between partially
+        - in the separation sum, a pair with 2 sqrt(2) h < d < radius -
+          2 sqrt(2) h is off by at most 2 sqrt(2) h / (d - 2 sqrt(2) h)^2,
+          against its exact 1 / d; closer pairs are softened (down to zero
+          on the same node), which mostly shows as a weaker separation in
+          very dense spots
+    so doubling the resolution halves the band of uncertain pairs.
+
+    Like SpatialGrid, with wrap=True the grid is a torus, and with groups
+    every group gets a grid of its own.
+    """
+    def __init__(self, positions, dirs, radius, size, wrap=False, groups=None, resolution=4):
+        self.positions = np.asarray(positions, dtype="float")
+        self.dirs = np.asarray(dirs, dtype="float")
+        self.size = np.asarray(size, dtype="float")
+        self.wrap = wrap
+        self.groups = np.zeros(len(self.positions), dtype="int") if groups is None else np.asarray(groups, dtype="int")
+        group_count = int(self.groups.max(initial=0)) + 1
+
+        # the nodes, anchored at -size (without wrapping, the grid grows by
+        # whole cells to cover points which left the tank), and the fft grid
+        # they live in, padded so the convolution doesn't wrap around
+        spacing = radius / resolution
+        if wrap:
+            origin = -self.size
+            nodes = np.maximum((2 * self.size // spacing).astype("int"), 1)
+            self.spacing = 2 * self.size / nodes
+            self.shape = nodes
+        else:
+            below = np.maximum(-self.size - self.positions.min(axis=0, initial=0), 0)
+            origin = -self.size - np.ceil(below / spacing) * spacing
+            end = np.maximum(self.size, self.positions.max(axis=0, initial=0))
+            nodes = np.ceil((end - origin) / spacing).astype("int") + 2
+            self.spacing = np.full(2, spacing)
+        reach = np.ceil(radius / self.spacing).astype("int")
+        if not wrap:
+            self.shape = nodes + reach
+
+        # bilinear weights of every point on its 4 nodes, corner (cx, cy) is
+        # the node at the cell's origin + (cx, cy)
+        points = wrapped(self.positions, self.size) if wrap else self.positions
+        f = (points - origin) / self.spacing
+        base = np.floor(f).astype("int")
+        t = f - base
+        width, height = self.shape
+        self.corners = []  # (flat node index, weight) per corner
+        for cy in (0, 1):
+            for cx in (0, 1):
+                node = base + (cx, cy)
+                if wrap:
+                    node %= self.shape
+                weight = (t[:, 0] if cx else 1 - t[:, 0]) * (t[:, 1] if cy else 1 - t[:, 1])
+                self.corners.append(((self.groups * height + node[:, 1]) * width + node[:, 0], weight))
+
+        # the kernels, as functions of u = evaluated node - depositing node
+        ix, iy = np.meshgrid(np.arange(-reach[0], reach[0] + 1), np.arange(-reach[1], reach[1] + 1))
+        u = np.stack((ix * self.spacing[0], iy * self.spacing[1]), axis=-1)
+        dist_sq = np.sum(u**2, axis=-1)
+        inside = dist_sq < radius**2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            count = inside.astype("float")
+            offset = -u * inside[..., None]  # the depositing node - the evaluated one
+            away = np.where((inside & (dist_sq > 0))[..., None], u / dist_sq[..., None], 0)
+        self.offsets = (ix, iy)
+
+        # one column per smoothed field: count, offset x and y, heading x and y,
+        # away x and y, each with the kernel and deposit it is smoothed from
+        self.kernels = np.stack((count, offset[..., 0], offset[..., 1], count, count, away[..., 0], away[..., 1]), axis=-1)
+        deposits = self._deposit(group_count, (None, self.dirs[:, 0], self.dirs[:, 1]))
+        smoothed = (0, 0, 0, 1, 2, 0, 0)
+
+        # smooth with ffts, and keep the fields as one row of columns per node
+        spectra = np.fft.rfft2(deposits, axes=(-2, -1))
+        fields = [np.fft.irfft2(spectra[d] * self._spectrum(self.kernels[..., c]), s=(height, width), axes=(-2, -1))
+                  for c, d in enumerate(smoothed)]
+        self.fields = np.stack(fields, axis=-1).reshape(-1, len(fields))
+
+    def _deposit(self, group_count, values):
+        width, height = self.shape
+        index = np.concatenate([flat for flat, _ in self.corners])
+        grids = []
+        for value in values:
+            weights = np.concatenate([w if value is None else w * value for _, w in self.corners])
+            grids.append(np.bincount(index, weights=weights, minlength=group_count * height * width).reshape(group_count, height, width))
+        return np.array(grids)
+
+    def _spectrum(self, kernel):
+        # lay the kernel out periodically over the fft grid, centered on node (0, 0)
+        width, height = self.shape
+        ix, iy = self.offsets
+        grid = np.zeros((height, width))
+        np.add.at(grid, (iy % height, ix % width), kernel)
+        return np.fft.rfft2(grid)
+
+    def lookup(self):
+        """
+        Returns the cohesion, alignment and separation sums of each point, each
+        as an (n, 2) array; all zero for points without others in range.
+        """
+        values = sum(w[:, None] * self.fields[flat] for flat, w in self.corners)
+
+        # subtract what the point's own deposit adds to what it reads back
+        cx, cy = self.offsets[0].shape[1] // 2, self.offsets[0].shape[0] // 2
+        own = 0
+        for a, (_, wa) in enumerate(self.corners):
+            for b, (_, wb) in enumerate(self.corners):
+                dx, dy = a % 2 - b % 2, a // 2 - b // 2
+                own = own + (wa * wb)[:, None] * self.kernels[cy + dy, cx + dx]
+        own[:, 3:5] *= self.dirs
+        values -= own
+
+        # below half a point, what's left is the partial weight of points at the
+        # edge of the range or rounding noise of the ffts
+        values[values[:, 0] < 0.5] = 0
+        return values[:, 1:3], values[:, 3:5], values[:, 5:7]
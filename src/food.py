@@ -1,14 +1,37 @@
-from time import sleep
 import numpy as np
 from src import PALETTE
+from src.grid import SpatialGrid
+
+
+def diamonds(positions, size=5):
+    """
+    Returns diamonds with half diagonal size around positions as an (n, 4, 2) array.
+    """
+    corners = size * np.array([[0, 1], [1, 0], [0, -1], [-1, 0]], dtype="float")  # top, right, bottom, left
+    return np.asarray(positions, dtype="float")[:, None, :] + corners
 
 
 class Food:
-    def __init__(self, pos=None, color=None, size=5):
-        # Use np.array directly to handle the position
-        self.pos = pos if pos is not None else np.random.uniform(-1, 1, size=2) * 400  # Adjust range as needed
-        self.color = color or PALETTE["food"]  # Ensure PALETTE has a 'food' color
-        self.size = size
+    """
+    A single food particle, as a view onto one slot of a `FoodField`.
+    """
+    __slots__ = ("field", "index")
+
+    def __init__(self, field, index):
+        self.field = field
+        self.index = index
+
+    @property
+    def pos(self):
+        return self.field._positions[self.index]
+
+    @property
+    def color(self):
+        return self.field.color
+
+    @property
+    def size(self):
+        return self.field.size
 
     def draw(self, canvas):
         # Create a diamond shape for the food
@@ -18,14 +41,138 @@ class Food:
         left = self.pos + np.array([-size, 0])
         right = self.pos + np.array([size, 0])
         canvas.draw_poly([top, right, bottom, left], self.color)
-        
-    def sprinkle(self, canvas, pos, x_count, food, food_spawn_chance):
-        for _ in range(x_count):
-            if np.random.random() < food_spawn_chance:
-                # Randomly offset each food particle around the provided position
-                new_pos = pos + np.random.uniform(-30, 30, size=2)  # Small random offset around the 'pos'
-                sprinkle_food = Food(pos=new_pos, color=self.color, size=self.size)
-                sprinkle_food.draw(canvas)
-                food.append(sprinkle_food)
-            
-        return food
\ No newline at end of file
+
+
+class FoodField:
+    """
+    All food particles of a universe, stored as one position array with an
+    alive mask. Eaten particles are only marked dead, the array is compacted
+    once they make up more than half of it.
+
+    Each particle belongs to a group (the tank, when several are simulated at
+    once), and is only found by points of the same group.
+    """
+    def __init__(self, color=None, size=5, capacity=64):
+        self.color = color or PALETTE["food"]
+        self.size = size
+        self._n = 0  # used slots, alive or not
+        self._count = 0  # alive slots
+        self._positions = np.zeros((capacity, 2), dtype="float")
+        self._alive = np.zeros(capacity, dtype="bool")
+        self._groups = np.zeros(capacity, dtype="int")
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def __iter__(self):
+        return (Food(self, i) for i in self.slots)
+
+    @property
+    def slots(self):
+        return np.nonzero(self._alive[:self._n])[0]
+
+    @property
+    def positions(self):
+        return self._positions[:self._n][self._alive[:self._n]]
+
+    @property
+    def groups(self):
+        return self._groups[:self._n][self._alive[:self._n]]
+
+    def add(self, positions, groups=0):
+        positions = np.asarray(positions, dtype="float").reshape(-1, 2)
+        start, stop = self._n, self._n + len(positions)
+        if stop > len(self._alive):
+            capacity = max(stop, 2 * len(self._alive))
+            self._positions = np.concatenate((self._positions, np.zeros((capacity - len(self._alive), 2))))
+            self._groups = np.concatenate((self._groups, np.zeros(capacity - len(self._alive), dtype="int")))
+            self._alive = np.concatenate((self._alive, np.zeros(capacity - len(self._alive), dtype="bool")))
+        self._positions[start:stop] = positions
+        self._groups[start:stop] = groups
+        self._alive[start:stop] = True
+        self._n = stop
+        self._count += len(positions)
+
+    def remove(self, slots):
+        self._alive[slots] = False
+        self._count = int(self._alive[:self._n].sum())
+        if self._n - self._count > self._n // 2:
+            self.compact()
+
+    def compact(self):
+        alive = self.slots
+        self._positions[:len(alive)] = self._positions[alive]
+        self._groups[:len(alive)] = self._groups[alive]
+        self._alive[:len(alive)] = True
+        self._alive[len(alive):] = False
+        self._n = len(alive)
+
+    def state(self):
+        """
+        Returns copies of the used slots, dead ones included, to restore the
+        field from later.
+        """
+        return {"positions": self._positions[:self._n].copy(),
+                "groups": self._groups[:self._n].copy(),
+                "alive": self._alive[:self._n].copy()}
+
+    def restore(self, state):
+        """
+        Replaces all food with the slots of a `state`.
+        """
+        self._n = self._count = 0
+        self._alive[:] = False
+        self.add(state["positions"], state["groups"])
+        self._alive[:self._n] = state["alive"]
+        self._count = int(self._alive[:self._n].sum())
+
+    def diamonds(self):
+        """
+        Returns the diamond shapes of all food particles as an (n, 4, 2) array.
+        """
+        return diamonds(self.positions, self.size)
+
+    def sprinkle(self, pos, count, chance, rng=None, group=0):
+        # Randomly offset each food particle around the provided position
+        rng = rng or np.random.default_rng()
+        spawned = rng.random(count) < chance
+        offsets = rng.uniform(-30, 30, size=(count, 2))  # Small random offset around the 'pos'
+        self.add(pos + offsets[spawned], group)
+
+    def nearest(self, points, radius, size, groups=None):
+        """
+        Finds the closest food of each point (in the point's group, if groups
+        are given), if there is one within radius. Returns the food slots (-1
+        where there is none) and the displacements from each point to its food.
+        """
+        points = np.asarray(points, dtype="float").reshape(-1, 2)
+        slots = np.full(len(points), -1, dtype="int")
+        diffs = np.zeros_like(points)
+        if not self:
+            return slots, diffs
+
+        alive = self.slots
+        grid = SpatialGrid(self._positions[alive], radius, size, groups=None if groups is None else self._groups[alive])
+        q, j, diff = grid.query(points, radius, groups)
+        # sort by point, then distance, and keep each point's first (closest) entry
+        order = np.lexsort((np.sum(diff**2, axis=-1), q))
+        q, first = np.unique(q[order], return_index=True)
+        slots[q] = alive[j[order][first]]
+        diffs[q] = diff[order][first]
+        return slots, diffs
+
+    def consume(self, points, radius, size, groups=None):
+        """
+        Lets every point eat the closest food within radius. Each point eats at
+        most one food, and food wanted by several points goes to the first of
+        them (the others can try again next tick). Returns the indices of the
+        points that ate.
+        """
+        slots, _ = self.nearest(points, radius, size, groups)
+        eaters = np.nonzero(slots >= 0)[0]
+        slots, first = np.unique(slots[eaters], return_index=True)  # eaters are ascending already
+        self.remove(slots)
+        return eaters[first]
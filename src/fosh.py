@@ -1,6 +1,4 @@
-import datetime
-from random import choice
-from src import FOSH_VEL, FOSH_TURN_SPEED, PALETTE, FOSH_TAIL_LEN, FOSH_SIZE, SATURATION
+from src import FOSH_TAIL_LEN, FOSH_SIZE, SATURATION
 import numpy as np
 
 
@@ -8,13 +6,77 @@ def _unit_vector(angle):
     return np.array([np.cos(angle), np.sin(angle)], dtype="float")
 
 
+def _unit_vectors(angles):
+    return np.stack((np.cos(angles), np.sin(angles)), axis=-1)
+
+
+def tails(positions, angles):
+    """
+    Returns the tail triangles of foshs at the given positions and angles, as
+    an (n, 3, 2) array. This is the same shape `fosh.draw` draws, for all
+    foshs at once.
+    """
+    tail_mesh = 10
+    tail_base = positions - (FOSH_SIZE - tail_mesh) * _unit_vectors(angles)
+    tail_angles = angles + np.pi
+
+    spread_angle = np.pi / 8
+    tail_left = tail_base + FOSH_TAIL_LEN * _unit_vectors(tail_angles + spread_angle)
+    tail_right = tail_base + FOSH_TAIL_LEN * _unit_vectors(tail_angles - spread_angle)
+    return np.stack((tail_base, tail_left, tail_right), axis=1)
+
+
 class fosh():
-    def __init__(self, color, pos, angle=0, speed=FOSH_VEL):
-        self.pos = np.array(pos, dtype="float")
-        self.angle = angle % (2 * np.pi)
-        self.color = color
-        self.speed = speed
-        self.last_bite = datetime.datetime.now() - datetime.timedelta(seconds=SATURATION)
+    """
+    A single fosh, as a view onto one row of a `Swarm`. All state lives in the
+    swarm's arrays, so writes through a fosh are seen by the whole-array
+    simulation and vice versa.
+    """
+    __slots__ = ("swarm", "index")
+
+    def __init__(self, swarm, index):
+        self.swarm = swarm
+        self.index = index
+
+    @property
+    def pos(self):
+        return self.swarm.positions[self.index]
+
+    @pos.setter
+    def pos(self, value):
+        self.swarm.positions[self.index] = value
+
+    @property
+    def angle(self):
+        return self.swarm.angles[self.index]
+
+    @angle.setter
+    def angle(self, value):
+        self.swarm.angles[self.index] = value % (2 * np.pi)
+
+    @property
+    def speed(self):
+        return self.swarm.speeds[self.index]
+
+    @speed.setter
+    def speed(self, value):
+        self.swarm.speeds[self.index] = value
+
+    @property
+    def last_bite(self):
+        return self.swarm.last_bite[self.index]
+
+    @last_bite.setter
+    def last_bite(self, value):
+        self.swarm.last_bite[self.index] = value
+
+    @property
+    def color(self):
+        return tuple(int(c) for c in self.swarm.colors[self.index])
+
+    @color.setter
+    def color(self, value):
+        self.swarm.colors[self.index] = value
 
     @property
     def dir(self):
@@ -23,25 +85,19 @@ class fosh():
     @property
     def vel(self):
         return self.speed * self.dir
-        
+
     @property
     def is_hungry(self):
-        return datetime.datetime.now() - self.last_bite > datetime.timedelta(seconds=SATURATION)
+        return self.swarm.clock.now - self.last_bite > SATURATION
 
     def dist(self, pos):
         return np.linalg.norm(self.pos - pos)
 
     def turn_by(self, dangle, dt):
-        # dont turn too fast
-        self.angle += np.clip(dangle, -dt * FOSH_TURN_SPEED, dt * FOSH_TURN_SPEED)
-
-        # keep angle in range [0, 2pi)
-        self.angle %= 2 * np.pi
+        self.swarm.turn_by(dangle, dt, self.index)
 
     def turn_to(self, angle, dt):
-        a = (angle - self.angle) % (2 * np.pi)
-        b = -(-a % (2 * np.pi))
-        self.turn_by(min(a, b, key=lambda x: np.abs(x)), dt)
+        self.swarm.turn_to(angle, dt, self.index)
 
     def draw(self, canvas):
         # Draw the circular body
@@ -54,12 +110,12 @@ class fosh():
         tail_base = circle_center - ( circle_radius - tail_mesh ) * _unit_vector(self.angle)
         tail_angle = self.angle + np.pi
         tail_tip = tail_base
-        
+
         # Calculate the left and right points for the tail
         spread_angle = np.pi / 8 # reduce to make points closer
         tail_left = tail_base + FOSH_TAIL_LEN * _unit_vector(tail_angle + spread_angle)
         tail_right = tail_base + FOSH_TAIL_LEN * _unit_vector(tail_angle - spread_angle)
-        
+
         # Draw the tail
         tail = [tail_tip, tail_left, tail_right]
         canvas.draw_poly(tail, self.color)
@@ -67,4 +123,3 @@ class fosh():
 
     def tick(self, dt):
         self.pos += self.vel * dt
-
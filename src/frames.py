@@ -0,0 +1,26 @@
+import queue
+import numpy as np
+
+
+class FramePool():
+    """
+    A fixed set of preallocated frames. Frames are taken with acquire and
+    handed back with release, in first in, first out order, so a frame that
+    was just released is the last one to be reused (which makes a pool of
+    two frames a double buffer).
+    """
+    def __init__(self, shape, count):
+        self.shape = tuple(shape)
+        self.free = queue.Queue()
+        for _ in range(count):
+            self.free.put(np.empty(self.shape, dtype="uint8"))
+
+    def acquire(self, block=True):
+        """
+        Takes a frame from the pool, raises queue.Empty if block is false and
+        all frames are in use.
+        """
+        return self.free.get(block=block)
+
+    def release(self, frame):
+        self.free.put(frame)
@@ -0,0 +1,199 @@
+import numpy as np
+
+
+# number of candidate pairs a query tests at once, bounds its temporary arrays
+BLOCK_SIZE = 2**16
+
+
+def wrapped(x, size):
+    """
+    Takes x into [-size, size), around a torus of that size. For differences
+    of positions, that is the shortest way from one to the other.
+    """
+    return (x + size) % (2 * size) - size
+
+
+class SpatialGrid():
+    """
+    Uniform grid spatial hash over the tank [-size, size]. The indexed points
+    are sorted by cell, so the points of cell c are order[start[c]:end[c]].
+    Queries only test the 3x3 block of cells around each query point, which
+    is exact for any radius up to the cell size.
+
+    With wrap=True the grid is a torus: cells at one edge neighbor the cells
+    at the opposite edge, and all distances are the shortest wrapped ones.
+
+    With groups (an int per point), every group gets a grid of its own, and
+    points only ever find points of their own group.
+    """
+    def __init__(self, positions, cell_size, size, wrap=False, groups=None):
+        self.positions = np.asarray(positions, dtype="float")
+        self.size = np.asarray(size, dtype="float")
+        self.wrap = wrap
+        self.groups = None if groups is None else np.asarray(groups, dtype="int")
+        self.group_count = 1 if groups is None or len(self.groups) == 0 else int(self.groups.max()) + 1
+
+        if wrap:
+            # the cells have to tile the torus exactly, so round their count down
+            # (making each cell at least cell_size wide)
+            self.shape = np.maximum((2 * self.size // cell_size).astype("int"), 1)
+            self.cell_size = 2 * self.size / self.shape
+        else:
+            self.shape = np.maximum(np.ceil(2 * self.size / cell_size).astype("int"), 1)
+            self.cell_size = np.full(2, cell_size, dtype="float")
+
+        cells = self.cell_of(self.positions)
+        self.cells = cells[:, 1] * self.shape[0] + cells[:, 0]
+        if self.groups is not None:
+            self.cells += self.groups * np.prod(self.shape)
+        self.order = np.argsort(self.cells, kind="stable")
+        counts = np.bincount(self.cells, minlength=np.prod(self.shape) * self.group_count)
+        self.end = np.cumsum(counts)
+        self.start = self.end - counts
+
+    def __len__(self):
+        return len(self.positions)
+
+    def cell_of(self, points):
+        """
+        Returns the (x, y) cell coordinates of each point. Points outside the
+        grid are clamped into the border cells, which keeps queries exact.
+        """
+        cells = np.floor((points + self.size) / self.cell_size).astype("int")
+        if self.wrap:
+            return cells % self.shape
+        return np.clip(cells, 0, self.shape - 1)
+
+    def displacement(self, a, b):
+        """
+        Returns b - a, the shortest way around the torus when wrapping.
+        """
+        return wrapped(b - a, self.size) if self.wrap else b - a
+
+    def _offsets(self, axis):
+        # with less than 3 cells along an axis, the wrapped offsets -1, 0, 1 would
+        # visit a cell twice, so just visit every cell of that axis once
+        if self.wrap and self.shape[axis] < 3:
+            return range(self.shape[axis])
+        return range(-1, 2)
+
+    def query(self, points, radius, groups=None):
+        """
+        Finds all indexed points within radius (< cell size) of each query point,
+        in the query point's group if the grid is grouped. Returns index arrays
+        (q, j) and the displacements from points[q] to positions[j].
+
+        The query points are handled in blocks of about BLOCK_SIZE candidates,
+        so the memory used does not grow with the number of candidates, only
+        with the number of pairs found.
+        """
+        points = np.asarray(points, dtype="float").reshape(-1, 2)
+        cells = self.cell_of(points)
+        # first cell of each query point's group, -1 for groups without any points
+        first_cell = np.zeros(len(points), dtype="int")
+        if self.groups is not None and groups is not None:
+            groups = np.asarray(groups, dtype="int")
+            first_cell = np.where(groups < self.group_count, groups * np.prod(self.shape), -1)
+
+        # the neighbor cells of each query point, -1 where there is none
+        neighbors = []
+        for dy in self._offsets(1):
+            for dx in self._offsets(0):
+                neighbor = cells + (dx, dy)
+                if self.wrap:
+                    neighbor %= self.shape
+                    valid = np.ones(len(points), dtype="bool")
+                else:
+                    valid = ((neighbor >= 0) & (neighbor < self.shape)).all(axis=1)
+                valid &= first_cell >= 0
+                neighbors.append(np.where(valid, neighbor[:, 1] * self.shape[0] + neighbor[:, 0] + first_cell, -1))
+        neighbors = np.array(neighbors)
+        lengths = np.where(neighbors >= 0, self.end[neighbors] - self.start[neighbors], 0)
+
+        # cut the query points into blocks of about BLOCK_SIZE candidates (at least one point each)
+        total = np.cumsum(lengths.sum(axis=0))
+        cuts = [0]
+        while cuts[-1] < len(points):
+            done = total[cuts[-1] - 1] if cuts[-1] else 0
+            cuts.append(max(int(np.searchsorted(total, done + BLOCK_SIZE, side="right")), cuts[-1] + 1))
+
+        out_q, out_j, out_diff = [], [], []
+        for start, stop in zip(cuts[:-1], cuts[1:]):
+            for cell, length in zip(neighbors[:, start:stop], lengths[:, start:stop]):
+                # expand each query point into the whole range of its neighbor cell
+                count = length.sum()
+                if count == 0:
+                    continue
+                first = np.cumsum(length) - length
+                q = np.repeat(np.arange(start, stop), length)
+                j = self.order[np.repeat(self.start[cell] - first, length) + np.arange(count)]
+                diff = self.displacement(points[q], self.positions[j])
+                inside = np.sum(diff**2, axis=-1) < radius**2
+                out_q.append(q[inside])
+                out_j.append(j[inside])
+                out_diff.append(diff[inside])
+
+        if not out_q:
+            return np.empty(0, dtype="int"), np.empty(0, dtype="int"), np.empty((0, 2), dtype="float")
+        return np.concatenate(out_q), np.concatenate(out_j), np.concatenate(out_diff)
+
+    def covers_all(self):
+        """
+        Whether the 3x3 block around any cell already is the whole grid.
+        """
+        return bool((self.shape <= (3 if self.wrap else 2)).all())
+
+    def pairs(self, radius):
+        """
+        Finds all pairs (i, j), i != j, of indexed points closer than radius.
+        """
+        i, j, diff = self.query(self.positions, radius, self.groups)
+        other = i != j
+        return i[other], j[other], diff[other]
+
+    def knn(self, k):
+        """
+        Finds the k nearest other indexed points of every indexed point.
+        Returns an (n, k) index matrix, each row sorted by distance.
+
+        Candidates come from the 3x3 cells around each point, the k nearest are
+        then picked by partial selection. Points with less than k candidates in
+        range are retried on grids with doubled cells until they are satisfied.
+        """
+        n = len(self)
+        smallest = n  # the size of the smallest group, which limits k
+        if self.groups is not None and n:
+            counts = np.bincount(self.groups)
+            smallest = counts[counts > 0].min()
+        k = max(min(k, smallest - 1), 0)
+        out = np.empty((n, k), dtype="int")
+        if k == 0:
+            return out
+
+        todo = np.arange(n)
+        grid = self
+        while len(todo):
+            radius = np.inf if grid.covers_all() else grid.cell_size.min()
+            q, j, diff = grid.query(self.positions[todo], radius, None if self.groups is None else self.groups[todo])
+            other = todo[q] != j
+            q, j, dist = q[other], j[other], np.sum(diff[other]**2, axis=-1)
+
+            # lay the candidates of each point out in one row of a padded matrix
+            order = np.argsort(q, kind="stable")
+            q, j, dist = q[order], j[order], dist[order]
+            counts = np.bincount(q, minlength=len(todo))
+            rank = np.arange(len(q)) - np.repeat(np.cumsum(counts) - counts, counts)
+            dists = np.full((len(todo), max(counts.max(), k)), np.inf)
+            candidates = np.zeros(dists.shape, dtype="int")
+            dists[q, rank] = dist
+            candidates[q, rank] = j
+
+            # partial selection of the k nearest, which then only need a small sort
+            best = np.argpartition(dists, k - 1, axis=1)[:, :k]
+            best = np.take_along_axis(best, np.argsort(np.take_along_axis(dists, best, axis=1), axis=1), axis=1)
+
+            done = counts >= k
+            out[todo[done]] = np.take_along_axis(candidates, best, axis=1)[done]
+            todo = todo[~done]
+            grid = SpatialGrid(self.positions, 2 * grid.cell_size.max(), self.size, self.wrap, self.groups)
+        return out
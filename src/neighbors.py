@@ -0,0 +1,99 @@
+from src.grid import SpatialGrid, wrapped
+import numpy as np
+
+
+# when more than this fraction of the points need new neighbors, it is
+# cheaper to search all of them at once
+REBUILD_FRACTION = 0.25
+
+
+class NeighborList():
+    """
+    Verlet list of all pairs of points closer than radius, which is reused
+    across ticks instead of searching the grid every tick.
+
+    The list holds all pairs within radius + skin, found by a grid search.
+    Every call filters it down to the pairs within radius, which is exact as
+    long as no two points together moved more than skin since their pair was
+    last searched. The distance each point moved since its own last search is
+    tracked; when the two largest add up to skin, the points which moved at
+    least skin / 2 (say, foshs speeding off with a meal) search for new
+    neighbors, or all points do if too many of them would.
+
+    Pairs are returned sorted by (i, j), so the result does not depend on
+    when the list was searched.
+    """
+    def __init__(self, radius, skin, size, wrap=False):
+        self.radius = radius
+        self.skin = skin
+        self.size = np.asarray(size, dtype="float")
+        self.wrap = wrap
+
+        self.i = self.j = None
+        self.last = None  # positions at the last call
+        self.travelled = None  # distance each point moved since its neighbors were searched
+        self.builds = 0
+        self.refreshes = 0
+
+    def _sorted(self, i, j, n):
+        order = np.argsort(i * n + j)
+        return i[order], j[order]
+
+    def build(self, positions, groups=None):
+        """
+        Searches the neighbors of all points.
+        """
+        grid = SpatialGrid(positions, self.radius + self.skin, self.size, self.wrap, groups)
+        i, j, _ = grid.pairs(self.radius + self.skin)
+        self.i, self.j = self._sorted(i, j, len(positions))
+        self.travelled = np.zeros(len(positions))
+        self.builds += 1
+
+    def refresh(self, points, positions, groups=None):
+        """
+        Searches the neighbors of only the given points again.
+        """
+        n = len(positions)
+        grid = SpatialGrid(positions, self.radius + self.skin, self.size, self.wrap, groups)
+        q, j, _ = grid.query(positions[points], self.radius + self.skin, None if groups is None else groups[points])
+        i = points[q]
+        other = i != j
+        i, j = i[other], j[other]
+
+        # drop all pairs of the points, and add both directions of their new
+        # pairs (only one if both points are refreshed, the other comes from
+        # the other point's search)
+        stale = np.zeros(n, dtype="bool")
+        stale[points] = True
+        keep = ~(stale[self.i] | stale[self.j])
+        reverse = ~stale[j]
+        self.i, self.j = self._sorted(np.concatenate((self.i[keep], i, j[reverse])),
+                                      np.concatenate((self.j[keep], j, i[reverse])), n)
+        self.travelled[points] = 0
+        self.refreshes += 1
+
+    def pairs(self, positions, groups=None):
+        """
+        Finds all pairs (i, j), i != j, of points closer than radius. Returns
+        the index arrays and the displacements from positions[i] to positions[j].
+        """
+        n = len(positions)
+        if self.i is None or len(self.last) != n:
+            self.build(positions, groups)
+        else:
+            moved = wrapped(positions - self.last, self.size) if self.wrap else positions - self.last
+            self.travelled += np.linalg.norm(moved, axis=-1)
+            if n >= 2 and np.partition(self.travelled, n - 2)[-2:].sum() >= self.skin:
+                points = np.nonzero(self.travelled >= self.skin / 2)[0]
+                if len(points) > REBUILD_FRACTION * n:
+                    self.build(positions, groups)
+                else:
+                    self.refresh(points, positions, groups)
+        self.last = positions.copy()
+
+        # one axis at a time, gathering single floats is a lot faster than rows
+        dx, dy = (positions[self.j, axis] - positions[self.i, axis] for axis in (0, 1))
+        if self.wrap:
+            dx, dy = wrapped(dx, self.size[0]), wrapped(dy, self.size[1])
+        inside = dx * dx + dy * dy < self.radius**2
+        return self.i[inside], self.j[inside], np.stack((dx[inside], dy[inside]), axis=-1)
@@ -0,0 +1,50 @@
+from time import perf_counter
+
+
+class FramePacer():
+    """
+    Keeps frames on a fixed schedule of 1 / fps seconds. Frame k is due at
+    start + k / fps, so any work done during a frame counts against its
+    budget and only the remaining time has to be waited for. A frame whose
+    deadline has already passed should be skipped (not rendered), and when
+    the schedule falls more than max_lag frames behind it is moved forward
+    instead of catching up.
+    """
+    def __init__(self, fps, max_lag=5):
+        self.fps = float(fps)
+        self.interval = 1 / self.fps
+        self.max_lag = max_lag
+
+        self.start = perf_counter()
+        self.deadline = self.start + self.interval
+        self.rendered = 0
+        self.skipped = 0
+
+    def remaining(self):
+        """
+        Seconds left until the current frame is due.
+        """
+        return self.deadline - perf_counter()
+
+    def overrun(self):
+        """
+        Whether the current frame is already late, counting it as skipped if it is.
+        """
+        if self.remaining() < 0:
+            self.skipped += 1
+            return True
+        self.rendered += 1
+        return False
+
+    def advance(self):
+        self.deadline += self.interval
+        if self.remaining() < -self.max_lag * self.interval:
+            self.deadline = perf_counter() + self.interval
+
+    @property
+    def achieved_fps(self):
+        elapsed = perf_counter() - self.start
+        return self.rendered / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        return f"rendered {self.rendered} frames at {self.achieved_fps:.1f} fps (target {self.fps:.1f} fps), skipped {self.skipped}"
@@ -0,0 +1,109 @@
+from collections import defaultdict, deque
+from time import perf_counter
+import threading
+import numpy as np
+from src.results import write_results
+
+
+PERCENTILES = (50, 90, 99)
+
+
+class _Phase():
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, perf_counter() - self.start)
+
+
+class _NullPhase():
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+class Profiler():
+    """
+    Times named phases of the tick, draw and update, e.g.
+
+        with profiler.phase("neighbors"):
+            ...
+
+    Keeps the last `window` samples of every phase for rolling percentiles,
+    plus a count and total over the whole run. Phases can be timed from
+    several threads at once.
+    """
+    enabled = True
+
+    def __init__(self, window=300, hud=False):
+        self.hud = hud  # whether to draw the timings onto the frames
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.counts = defaultdict(int)
+        self.totals = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.samples[name].append(seconds)
+            self.counts[name] += 1
+            self.totals[name] += seconds
+
+    def summary(self):
+        """
+        Returns the rolling percentiles (in ms) and run totals of every phase.
+        """
+        out = {}
+        with self.lock:
+            phases = {name: (list(samples), self.counts[name], self.totals[name]) for name, samples in self.samples.items()}
+        for name, (samples, count, total) in phases.items():
+            ms = 1000 * np.array(samples)
+            out[name] = {
+                "count": count,
+                "total_s": total,
+                "mean_ms": 1000 * total / count,
+                **{f"p{q}_ms": p for q, p in zip(PERCENTILES, np.percentile(ms, PERCENTILES).tolist())}}
+        return out
+
+    def lines(self):
+        """
+        Returns one line of text per phase, for an on-screen overlay.
+        """
+        return [f"{name:<12}" + "".join(f" p{q} {stats[f'p{q}_ms']:6.2f}ms" for q in PERCENTILES)
+                for name, stats in self.summary().items()]
+
+    def dump(self, path):
+        """
+        Writes the summary to path, as csv if it ends in .csv and json otherwise.
+        """
+        summary = self.summary()
+        if path.endswith(".csv"):
+            summary = [{"phase": name, **stats} for name, stats in summary.items()]
+        write_results(path, summary)
+
+
+class NullProfiler():
+    """
+    A profiler which does nothing, so the timers cost next to nothing when
+    profiling is off.
+    """
+    enabled = False
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def record(self, name, seconds):
+        pass
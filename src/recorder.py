@@ -0,0 +1,93 @@
+from tempfile import TemporaryFile
+import queue
+import threading
+import cv2
+import numpy as np
+from src.frames import FramePool
+
+
+RECORD_POLICIES = ("block", "drop", "spill")
+
+
+class Recorder():
+    """
+    A drop-in for cv2.VideoWriter which encodes on a background thread.
+
+    `write` copies the frame into a buffer from a small FramePool and returns,
+    the encoder thread writes the buffers out in order and releases them.
+    When all buffers are in use, the policy decides what happens to the next
+    frame:
+        block: wait for the encoder to free a buffer
+        drop:  skip the frame (the video gets shorter)
+        spill: append the frame to a temporary file, encoded later in order
+    """
+    def __init__(self, filename, fps, res, policy="block", buffers=8, spill_dir=None):
+        if policy not in RECORD_POLICIES:
+            raise ValueError(f"unknown record policy {policy!r}, expected one of {RECORD_POLICIES}")
+        self.policy = policy
+        self.shape = (int(res[1]), int(res[0]), 3)
+        self.writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*"mp4v"), int(fps), (int(res[0]), int(res[1])))
+
+        self.buffers = FramePool(self.shape, buffers)
+        self.pending = queue.Queue()  # ("buffer", frame) or ("spill", offset) in frame order, None to stop
+
+        self.spill = None
+        self.spill_dir = spill_dir
+        self.spill_lock = threading.Lock()
+        self.spilled_pending = 0
+
+        self.dropped = 0
+        self.spilled = 0
+
+        self.thread = threading.Thread(target=self._encode, name="fosh-recorder", daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        try:
+            buffer = self.buffers.acquire(block=self.policy == "block")
+        except queue.Empty:
+            if self.policy == "drop":
+                self.dropped += 1
+            else:
+                self.pending.put(("spill", self._spill(frame)))
+                self.spilled += 1
+            return
+
+        np.copyto(buffer, frame)
+        self.pending.put(("buffer", buffer))
+
+    def release(self):
+        self.pending.put(None)
+        self.thread.join()
+        self.writer.release()
+        if self.spill is not None:
+            self.spill.close()
+
+    def _spill(self, frame):
+        with self.spill_lock:
+            if self.spill is None:
+                self.spill = TemporaryFile(dir=self.spill_dir)
+            self.spill.seek(0, 2)
+            offset = self.spill.tell()
+            self.spill.write(np.ascontiguousarray(frame).tobytes())
+            self.spilled_pending += 1
+            return offset
+
+    def _unspill(self, offset):
+        with self.spill_lock:
+            self.spill.seek(offset)
+            frame = np.frombuffer(self.spill.read(int(np.prod(self.shape))), dtype="uint8").reshape(self.shape)
+            self.spilled_pending -= 1
+            if self.spilled_pending == 0:
+                # everything spilled so far is encoded, start the file over
+                self.spill.truncate(0)
+            return frame
+
+    def _encode(self):
+        while (item := self.pending.get()) is not None:
+            kind, payload = item
+            if kind == "buffer":
+                self.writer.write(payload)
+                self.buffers.release(payload)
+            else:
+                self.writer.write(self._unspill(payload))
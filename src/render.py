@@ -0,0 +1,155 @@
+"""
+Offline rendering of recorded trajectories, in parallel.
+
+    python -m src.render run.traj                      # all ticks, to out/run.mp4
+    python -m src.render run.traj --res 3840x2160 --start 1800 --stop 3600 -j 8
+
+The frames to render are split into chunks, each rendered by a worker
+process with its own canvas and video writer into a segment of the video.
+The segments are joined with ffmpeg, without re-encoding them; without
+ffmpeg, only a single chunk can be rendered (--chunks 1).
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count, makedirs, replace
+from os.path import basename, dirname, join, splitext
+from shutil import which
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import subprocess
+import cv2
+from src import OUT_DIR
+from src.canvas import Canvas
+from src.trajectory import TrajectoryReader, replay
+
+
+FOURCC = "mp4v"
+
+
+def _writer(filename, fps, res):
+    return cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*FOURCC), fps, tuple(int(x) for x in res))
+
+
+def _render_chunk(path, segment, res, fps, start, stop, step, sprites):
+    """
+    Renders the ticks start, start + step, ... before stop of the trajectory
+    at path into the video segment. Runs in a worker process.
+    """
+    canvas = Canvas(res, fps, sprites=sprites, show=False)
+    canvas.video = _writer(segment, fps, canvas.res)  # released by the canvas on exit
+    with canvas:
+        return replay(TrajectoryReader(path), canvas, start, stop, step)
+
+
+def chunks(start, stop, step, count):
+    """
+    Splits the ticks start, start + step, ... before stop into at most count
+    consecutive (start, stop) ranges with the same number of frames (give or
+    take one).
+    """
+    frames = max(0, -(-(stop - start) // step))
+    count = max(1, min(count, frames))
+    bounds = [start + step * (frames * i // count) for i in range(count + 1)]
+    return [(a, min(b, stop)) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+def concat(segments, output):
+    """
+    Joins the video segments into output, in order, without re-encoding
+    them. More than one segment needs ffmpeg.
+    """
+    if len(segments) == 1:
+        replace(segments[0], output)
+        return
+
+    listing = join(dirname(segments[0]), "segments.txt")
+    with open(listing, "w") as f:
+        f.writelines(f"file '{segment}'\n" for segment in segments)
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", listing, "-c", "copy", output],
+                   check=True)
+
+
+def render(path, output, res=(1920, 1080), fps=30.0, start=0, stop=None, workers=None, chunk_count=None, sprites=False):
+    """
+    Renders the ticks start to stop of the trajectory at path into the video
+    output, one frame per 1 / fps of simulated time, with a pool of worker
+    processes. Returns the number of frames rendered.
+
+    Joining several chunks needs ffmpeg, which is checked before rendering
+    anything.
+    """
+    reader = TrajectoryReader(path)
+    start, stop = reader.record_of(start), len(reader) if stop is None else reader.record_of(stop)
+    step = max(1, round(1 / (reader.dt * fps)))
+    workers = workers or cpu_count()
+    ranges = chunks(start, stop, step, chunk_count or workers)
+    if not ranges:
+        return 0
+    if len(ranges) > 1 and not which("ffmpeg"):
+        # re-encoding the segments instead would be slow (on a single core) and lossy
+        raise RuntimeError(f"joining {len(ranges)} video segments needs ffmpeg, install it or render a single chunk")
+
+    if dirname(output):
+        makedirs(dirname(output), exist_ok=True)
+    with TemporaryDirectory(dir=dirname(output) or None) as tmp:
+        segments = [join(tmp, f"{i:05d}.mp4") for i in range(len(ranges))]
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_render_chunk, path, segment, res, fps, a, b, step, sprites)
+                       for segment, (a, b) in zip(segments, ranges)]
+            frames = sum(future.result() for future in futures)
+        concat(segments, output)
+    return frames
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="render a recorded trajectory into a video, in parallel")
+    parser.add_argument("trajectory",
+                        help="the trajectory file, as recorded with --trajectory")
+    parser.add_argument("-o", "--output",
+                        default=None,
+                        help="the video to write (defaults to the trajectory's name in the output directory)")
+    parser.add_argument("--res",
+                        type=str,
+                        default="1920x1080",
+                        help="the resolution")
+    parser.add_argument("--fps",
+                        type=float,
+                        default=30.0,
+                        help="the framerate of the video")
+    parser.add_argument("--start",
+                        type=int,
+                        default=0,
+                        help="the first tick of the trajectory to render")
+    parser.add_argument("--stop",
+                        type=int,
+                        default=None,
+                        help="the tick of the trajectory to stop before")
+    parser.add_argument("-j", "--workers",
+                        type=int,
+                        default=None,
+                        help="the number of worker processes (defaults to the number of cores)")
+    parser.add_argument("--chunks",
+                        type=int,
+                        default=None,
+                        help="the number of segments to split the video into (defaults to one per worker, more than one needs ffmpeg)")
+    parser.add_argument("--sprites",
+                        action="store_true",
+                        help="draw the foshs from a pre-rendered sprite atlas")
+    args = parser.parse_args()
+
+    output = args.output or OUT_DIR + splitext(basename(args.trajectory))[0] + ".mp4"
+    start = perf_counter()
+    try:
+        frames = render(args.trajectory,
+                        output,
+                        res=tuple(int(x) for x in args.res.split("x")),
+                        fps=args.fps,
+                        start=args.start,
+                        stop=args.stop,
+                        workers=args.workers,
+                        chunk_count=args.chunks,
+                        sprites=args.sprites)
+    except RuntimeError as e:
+        parser.error(f"{e} (--chunks 1)")
+    elapsed = perf_counter() - start
+    print(f"rendered {frames} frames to {output} in {elapsed:.2f}s ({frames / max(elapsed, 1e-9):.1f} frames/sec)")
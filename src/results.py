@@ -0,0 +1,21 @@
+from os import makedirs
+from os.path import dirname
+import csv
+import json
+
+
+def write_results(path, data):
+    """
+    Writes results to path, creating its directory if needed: as csv if path
+    ends in .csv (data then being a list of dicts with the same keys, one per
+    row), and as indented json otherwise.
+    """
+    if dirname(path):
+        makedirs(dirname(path), exist_ok=True)
+    with open(path, "w", newline="") as f:
+        if path.endswith(".csv"):
+            writer = csv.DictWriter(f, list(data[0]) if data else [])
+            writer.writeheader()
+            writer.writerows(data)
+        else:
+            json.dump(data, f, indent=2)
@@ -0,0 +1,145 @@
+from src import SCALE, FOSH_SIZE
+from src.fosh import tails
+from numpy.lib.stride_tricks import as_strided
+import cv2
+import numpy as np
+
+
+SPRITE_BINS = 64
+CHUNKS = (16, 8, 4, 2, 1)  # lengths of the pieces the solid rows of a sprite are written in
+
+
+def _pad(rows, fill):
+    """
+    Stacks 1d arrays of different lengths into one 2d array, padding each
+    short one with its own fill value.
+    """
+    width = max(map(len, rows))
+    return np.array([np.concatenate((row, np.full(width - len(row), f, dtype=row.dtype))) for row, f in zip(rows, fill)])
+
+
+class SpriteAtlas():
+    """
+    The fosh shape pre-rendered (antialiased) at `bins` quantized headings.
+    Each heading is kept as the offsets of its pixels from the fosh's pixel:
+    the solid ones in pieces of rows, which are filled with the fosh's color,
+    and the edge ones with their alpha, which are blended. So all foshs are
+    drawn with a handful of array operations over all of their pixels, no
+    matter how many there are or how complicated the shape is.
+    """
+    def __init__(self, bins=SPRITE_BINS):
+        self.bins = bins
+        angles = 2 * np.pi * np.arange(bins) / bins
+        shapes = tails(np.zeros((bins, 2)), angles)
+
+        # center to edge of a sprite in px, with a little room for antialiasing
+        self.half = half = int(np.ceil(max(FOSH_SIZE, np.abs(shapes).max() * SCALE))) + 2
+        side = 2 * half + 1
+
+        masks = []
+        for tail in shapes:
+            mask = np.zeros((side, side), dtype="uint8")
+            cv2.circle(mask, (half, half), FOSH_SIZE, 255, -1, cv2.LINE_AA)
+
+            # same transform as Canvas.to_px, but with 4 bits of subpixel precision
+            px = np.round((tail * (SCALE, -SCALE) + half) * 16).astype("int32")[None]
+            cv2.fillPoly(mask, px, 255, cv2.LINE_AA, 4)
+            masks.append(mask)
+
+        # the runs of solid pixels of every row, as (length, y, x) from the sprite's center
+        runs = []
+        for mask in masks:
+            # where a row changes from or to solid, pairs of (start, end) per row
+            change = np.argwhere(np.diff(mask == 255, axis=1, prepend=False, append=False))
+            ys, starts, ends = change[::2, 0], change[::2, 1], change[1::2, 1]
+            runs.append(list(zip((ends - starts).tolist(), (ys - half).tolist(), (starts - half).tolist())))
+        # only chunks which fit into the widest row of every bin, which pads the pieces
+        widest = [max(r) for r in runs]
+        self.chunks = tuple(chunk for chunk in CHUNKS if chunk <= min(widest)[0])
+
+        edge, alpha = [], []  # offsets of the edge pixels, and their alpha
+        pieces = {chunk: [] for chunk in self.chunks}  # offsets of the first pixel of each piece, by length
+        for mask, rows in zip(masks, runs):
+            edge.append(np.argwhere((mask > 0) & (mask < 255)) - half)
+            alpha.append(mask[tuple(edge[-1].T + half)].astype("float32") / 255)
+
+            # each run is covered by pieces of the longest chunk that fits into
+            # it, the last one overlapping the one before
+            starts = {chunk: [] for chunk in self.chunks}
+            for length, y, x in rows:
+                chunk = next(chunk for chunk in self.chunks if chunk <= length)
+                starts[chunk] += [(y, x + dx) for dx in [*range(0, length - chunk, chunk), length - chunk]]
+            for chunk in self.chunks:
+                pieces[chunk].append(np.array(starts[chunk], dtype="int").reshape(-1, 2))
+
+        # (dy, dx) pairs of (bins, k) arrays. The bins are padded to the same k
+        # with pixels which are drawn anyway: their first one, or for the pieces,
+        # the start of their widest row
+        self.edge = tuple(_pad([p[:, k] for p in edge], [p[0, k] for p in edge]) for k in (0, 1))
+        self.pieces = {chunk: tuple(_pad([p[:, k] for p in pieces[chunk]], [w[1 + k] for w in widest]) for k in (0, 1))
+                       for chunk in self.chunks}
+        self.alpha = _pad(alpha, [a[0] for a in alpha])
+        self.beta = 1 - self.alpha
+
+        # the frame is drawn into as a BGRA copy with a margin, reused across frames
+        self.margin = 2 * half  # room for every pixel of every fosh reaching into the frame
+        self.layer = None
+        self.offsets = None  # flat offsets of the edges and the pieces in the layer
+
+    def bin_of(self, angles):
+        return np.round(angles * self.bins / (2 * np.pi)).astype("int") % self.bins
+
+    def _flat(self, frame, rows):
+        """
+        Copies the rows of frame into the layer, and returns the whole layer
+        as a flat array of one uint32 per pixel.
+        """
+        height, width = frame.shape[:2]
+        m = self.margin
+        if self.layer is None or self.layer.shape[:2] != (height + 2 * m, width + 2 * m):
+            self.layer = np.empty((height + 2 * m, width + 2 * m, 4), dtype="uint8")
+            stride = width + 2 * m
+            self.offsets = {chunk: dy * stride + dx for chunk, (dy, dx) in [(None, self.edge), *self.pieces.items()]}
+        cv2.cvtColor(frame[rows], cv2.COLOR_BGR2BGRA, dst=self.layer[m + rows.start:m + rows.stop, m:-m])
+        return self.layer.reshape(-1).view("uint32")
+
+    def blit(self, frame, px, angles, colors):
+        """
+        Blends the sprites of foshs with the given pixel positions, angles and
+        colors into frame.
+
+        The frame is drawn into as a BGRA copy, so every pixel is a single
+        uint32 which is read and written with one index, and with a margin,
+        so no sprite needs to be clipped. Only the rows the sprites reach
+        into are copied there and back. The edges of all foshs are blended
+        in first, then all solid pixels are written over them: where foshs
+        overlap, they merge into one shape.
+        """
+        height, width = frame.shape[:2]
+        m = self.margin
+        visible = ((px > -self.half) & (px < (width + self.half, height + self.half))).all(axis=1)
+        if not visible.any():
+            return
+        x, y = px[visible, 0], px[visible, 1]
+        rows = slice(max(int(y.min()) - self.half, 0), min(int(y.max()) + self.half + 1, height))
+        flat = self._flat(frame, rows)
+
+        x, y = x + m, y + m
+        bins = self.bin_of(angles[visible])
+        base = (y * (width + 2 * m) + x)[:, None]
+        packed = np.concatenate((colors[visible], np.zeros((len(x), 1))), axis=1).astype("uint8").view("uint32")
+
+        # blended as a single row of pixels, which opencv goes through a lot faster than a column
+        index = base + self.offsets[None][bins]
+        blended = cv2.blendLinear(flat[index].view("uint8").reshape(1, -1, 4),
+                                  np.repeat(packed, index.shape[1]).view("uint8").reshape(1, -1, 4),
+                                  self.beta[bins].reshape(1, -1),
+                                  self.alpha[bins].reshape(1, -1))
+        flat[index] = blended.view("uint32").reshape(index.shape)
+
+        for chunk in self.chunks:
+            # each row of the window is the chunk of pixels starting at a pixel
+            window = as_strided(flat, (len(flat) - chunk + 1, chunk), (flat.itemsize, flat.itemsize))
+            window[base + self.offsets[chunk][bins]] = packed[:, :, None]
+
+        cv2.cvtColor(self.layer[m + rows.start:m + rows.stop, m:-m], cv2.COLOR_BGRA2BGR, dst=frame[rows])
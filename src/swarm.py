@@ -0,0 +1,131 @@
+from src import FOSH_VEL, FOSH_TURN_SPEED, SATURATION
+from src.clock import Clock
+from src.fosh import fosh
+import numpy as np
+
+
+class Swarm():
+    """
+    Structure-of-arrays store for all foshs of a universe. Every attribute
+    lives in one contiguous array with a row per fosh, so the whole school can
+    be turned and moved with a handful of numpy operations. Indexing a swarm
+    gives a `fosh`, which is only a view onto one of those rows.
+
+    Times (like last_bite) are simulation seconds of the swarm's clock.
+    """
+    def __init__(self, clock=None, capacity=64):
+        self.clock = clock or Clock()
+        self._n = 0
+        self._positions = np.zeros((capacity, 2), dtype="float")
+        self._angles = np.zeros(capacity, dtype="float")
+        self._speeds = np.zeros(capacity, dtype="float")
+        self._last_bite = np.zeros(capacity, dtype="float")
+        self._colors = np.zeros((capacity, 3), dtype="uint8")
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, index):
+        if not -self._n <= index < self._n:
+            raise IndexError("swarm index out of range")
+        return fosh(self, index % self._n)
+
+    def __iter__(self):
+        return (fosh(self, i) for i in range(self._n))
+
+    # views onto the used part of the buffers, these stay valid until the next add
+    @property
+    def positions(self):
+        return self._positions[:self._n]
+
+    @property
+    def angles(self):
+        return self._angles[:self._n]
+
+    @property
+    def speeds(self):
+        return self._speeds[:self._n]
+
+    @property
+    def last_bite(self):
+        return self._last_bite[:self._n]
+
+    @property
+    def colors(self):
+        return self._colors[:self._n]
+
+    @property
+    def dirs(self):
+        return np.stack((np.cos(self.angles), np.sin(self.angles)), axis=-1)
+
+    @property
+    def vels(self):
+        return self.speeds[:, None] * self.dirs
+
+    def hungry(self):
+        return self.clock.now - self.last_bite > SATURATION
+
+    def _reserve(self, n):
+        capacity = len(self._angles)
+        if n <= capacity:
+            return
+        while capacity < n:
+            capacity *= 2
+        for name in ("_positions", "_angles", "_speeds", "_last_bite", "_colors"):
+            old = getattr(self, name)
+            new = np.zeros((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+
+    def add(self, colors, positions, angles=0, speeds=FOSH_VEL):
+        """
+        Appends foshs to the swarm. `positions` is an (n, 2) array, all other
+        arguments are broadcast against it. Returns the indices of the new foshs.
+        """
+        positions = np.asarray(positions, dtype="float").reshape(-1, 2)
+        n = len(positions)
+        start, stop = self._n, self._n + n
+
+        self._reserve(stop)
+        self._positions[start:stop] = positions
+        self._angles[start:stop] = np.asarray(angles, dtype="float") % (2 * np.pi)
+        self._speeds[start:stop] = speeds
+        self._last_bite[start:stop] = self.clock.now - SATURATION
+        self._colors[start:stop] = colors
+        self._n = stop
+        return np.arange(start, stop)
+
+    def state(self):
+        """
+        Returns copies of all fosh arrays, to restore the swarm from later.
+        """
+        return {"positions": self.positions.copy(),
+                "angles": self.angles.copy(),
+                "speeds": self.speeds.copy(),
+                "last_bite": self.last_bite.copy(),
+                "colors": self.colors.copy()}
+
+    def restore(self, state):
+        """
+        Replaces all foshs with the ones of a `state`.
+        """
+        self._n = 0
+        self._reserve(len(state["positions"]))
+        self._n = len(state["positions"])
+        for name in ("positions", "angles", "speeds", "last_bite", "colors"):
+            getattr(self, name)[:] = state[name]
+
+    def turn_by(self, dangles, dt, index=slice(None)):
+        # dont turn too fast
+        self.angles[index] += np.clip(dangles, -dt * FOSH_TURN_SPEED, dt * FOSH_TURN_SPEED)
+
+        # keep angles in range [0, 2pi)
+        self.angles[index] %= 2 * np.pi
+
+    def turn_to(self, angles, dt, index=slice(None)):
+        a = (angles - self.angles[index]) % (2 * np.pi)
+        b = -(-a % (2 * np.pi))
+        self.turn_by(np.where(np.abs(a) <= np.abs(b), a, b), dt, index)
+
+    def tick(self, dt):
+        self.positions[:] += self.vels * dt
@@ -0,0 +1,144 @@
+"""
+Parameter sweeps over the flocking weights.
+
+    python -m src.sweep --sep 0.5 1 1.5 2 --cohes 0.5 1 --seeds 0 1 2 -o out/sweep.csv
+
+Every combination of the given weights and seeds is one tank. Tanks are
+simulated in batches (a BatchUniverse each), spread over a pool of worker
+processes. The metrics of each tank are averaged over the second half of
+its run, after the school had time to settle.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from os import cpu_count
+from time import perf_counter
+import numpy as np
+from src import OUT_DIR, DEFAULT_VIEW_DIST, DEFAULT_NUM_NEIGHBORS
+from src.batch import BatchUniverse, WEIGHTS
+from src.results import write_results
+
+
+def run_batch(configs, n, ticks, sample_every=10, **kwargs):
+    """
+    Simulates one tank per config (weights and a seed) for the given number of
+    ticks, returns each config with its metrics.
+    """
+    u = BatchUniverse([{key: config[key] for key in WEIGHTS if key in config} for config in configs],
+                      seeds=[config["seed"] for config in configs],
+                      **kwargs)
+    u.populate(n)
+
+    samples = []
+    for tick in range(ticks):
+        u.tick()
+        if tick >= ticks // 2 and (ticks - 1 - tick) % sample_every == 0:
+            samples.append(u.metrics())
+
+    rows = []
+    for k, config in enumerate(configs):
+        row = dict(config)
+        for key in samples[0]:
+            row[key] = float(np.mean([sample[key][k] for sample in samples]))
+        row["eaten"] = int(u.eaten[k])
+        rows.append(row)
+    return rows
+
+
+def sweep(configs, n, ticks, batch_size=8, workers=None, **kwargs):
+    """
+    Runs all configs in batches of batch_size tanks on a process pool, returns
+    the rows of run_batch in the order of configs.
+    """
+    batches = [configs[i:i + batch_size] for i in range(0, len(configs), batch_size)]
+    with ProcessPoolExecutor(workers or cpu_count()) as pool:
+        futures = [pool.submit(run_batch, batch, n, ticks, **kwargs) for batch in batches]
+        return [row for future in futures for row in future.result()]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="sweep the flocking weights and compare the resulting schools")
+    parser.add_argument("--sep",
+                        type=float,
+                        nargs="+",
+                        default=[1.5],
+                        help="the seperation weights to try")
+    parser.add_argument("--align",
+                        type=float,
+                        nargs="+",
+                        default=[1.0],
+                        help="the alignment weights to try")
+    parser.add_argument("--cohes",
+                        type=float,
+                        nargs="+",
+                        default=[1.0],
+                        help="the cohesion weights to try")
+    parser.add_argument("--food-weight",
+                        dest="food_weight",
+                        type=float,
+                        nargs="+",
+                        default=[1.5],
+                        help="the food weights to try")
+    parser.add_argument("--seeds",
+                        type=int,
+                        nargs="+",
+                        default=[0],
+                        help="the seeds to run every combination of weights with")
+    parser.add_argument("-n",
+                        dest="n",
+                        type=int,
+                        default=60,
+                        help="the number of foshs per tank")
+    parser.add_argument("--ticks",
+                        type=int,
+                        default=1000,
+                        help="the number of ticks to simulate per tank")
+    parser.add_argument("--tick-rate",
+                        dest="tick_rate",
+                        type=float,
+                        default=30.0,
+                        help="the simulation rate in ticks per simulated second")
+    parser.add_argument("-e", "--edge-behaviour",
+                        dest="edge_behaviour",
+                        choices={"avoid", "wrap"},
+                        default="avoid",
+                        help="the behaviour of the foshs near edges")
+    parser.add_argument("--count",
+                        dest="num_neighbors",
+                        nargs="?",
+                        type=int,
+                        const=DEFAULT_NUM_NEIGHBORS,
+                        help="see the COUNT closest foshs instead of all within the view distance")
+    parser.add_argument("--batch",
+                        type=int,
+                        default=8,
+                        help="the number of tanks simulated together")
+    parser.add_argument("-j", "--workers",
+                        type=int,
+                        default=None,
+                        help="the number of worker processes (defaults to the number of cores)")
+    parser.add_argument("-o", "--output",
+                        default=OUT_DIR + "sweep.csv",
+                        help="where to write the metrics, as csv if it ends in .csv and json otherwise")
+    args = parser.parse_args()
+
+    configs = [{"sep": sep, "align": align, "cohes": cohes, "food_weight": food_weight, "seed": seed}
+               for sep, align, cohes, food_weight, seed in product(args.sep, args.align, args.cohes, args.food_weight, args.seeds)]
+
+    start = perf_counter()
+    rows = sweep(configs,
+                 args.n,
+                 args.ticks,
+                 batch_size=args.batch,
+                 workers=args.workers,
+                 edge_behaviour=args.edge_behaviour,
+                 nearby_method="dist" if args.num_neighbors is None else "count",
+                 view_dist=DEFAULT_VIEW_DIST,
+                 num_neighbors=args.num_neighbors or DEFAULT_NUM_NEIGHBORS,
+                 dt=1 / args.tick_rate)
+    elapsed = perf_counter() - start
+
+    for row in rows:
+        print("  ".join(f"{key} {value:.3g}" if isinstance(value, float) else f"{key} {value}" for key, value in row.items()))
+    write_results(args.output, rows)
+    print(f"{len(rows)} tanks in {elapsed:.2f}s, wrote {args.output}")
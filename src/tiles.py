@@ -0,0 +1,218 @@
+"""
+Spatial domain decomposition of one tank over worker processes.
+
+The tank is cut into horizontal strips, each simulated by a worker process.
+The foshs live in a block of shared memory which every worker can read, so
+the foshs of the neighbouring strips within reach of a strip (its ghost
+band) don't need to be sent around. Every tick, a worker turns and moves
+the foshs of its own strip, with its ghosts only in view, and writes only
+those back. The strips are cut anew every tick, at the quantiles of the
+foshs' heights so all strips own about as many foshs; foshs crossing into
+another strip simply belong to that worker from then on.
+
+Everything else of a tick (food, trajectory, checkpoints) stays in the
+main process. The results are the same as those of a single Universe with
+the same seed, down to the last bit.
+"""
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+from os import cpu_count
+import numpy as np
+from src.canvas import NullCanvas
+from src.field import DensityField
+from src.grid import SpatialGrid, wrapped
+from src.universe import Universe, CROWDING_RADIUS
+
+
+# rows of the shared block, each with a value per fosh: the state before the
+# tick (read by all workers), and after it (written by the owner of each fosh)
+ROWS = ("x", "y", "angle", "speed", "last_bite", "new_x", "new_y", "new_angle", "new_speed")
+
+
+def _rows(shm, n):
+    block = np.ndarray((len(ROWS), n), dtype="float", buffer=shm.buf)
+    return dict(zip(ROWS, block))
+
+
+def ghost_width(u):
+    """
+    How far beyond its strip a worker needs to see the foshs: the view
+    distance for flocking, and the crowding radius for crowding, plus a cell
+    if it is looked up in a density field (which sums whole cells).
+    """
+    if not u.crowding_resolution:
+        return max(u.view_dist, CROWDING_RADIUS) + 1  # and a bit for rounding
+    cell = CROWDING_RADIUS / u.crowding_resolution
+    if u.edge_behaviour == "wrap":
+        cell = 2 * u.size[1] / max(2 * u.size[1] // cell, 1)
+    return max(u.view_dist, CROWDING_RADIUS + cell) + 1  # and a bit for rounding
+
+
+def strip(y, low, high, width, period=None):
+    """
+    Whether each height y is within width of the strip [low, high), around
+    a torus of the given period if there is one.
+    """
+    if period is None:
+        return (y >= low - width) & (y < high + width)
+    if high - low + 2 * width >= period:
+        return np.ones(len(y), dtype="bool")
+    shift = (y - low) % period
+    return (shift < high - low + width) | (shift >= period - width)
+
+
+class Tile(Universe):
+    """
+    The universe of a single worker, holding the foshs of its strip and its
+    ghost band. Searches its neighbors from scratch every tick (the foshs in
+    it change every tick), in the same order as the whole universe would.
+    """
+    bounds = None  # the corners of all foshs of the tank, for the density field
+
+    def get_nearby(self):
+        grid = SpatialGrid(self.swarm.positions, self.view_dist, self.size, wrap=self.edge_behaviour == "wrap")
+        i, j, _ = grid.pairs(self.view_dist)
+        if self.skin > 0:
+            # sorted by (i, j), like the neighbor list
+            order = np.argsort(i * len(self.swarm) + j)
+            i, j = i[order], j[order]
+        return i, j
+
+    def get_crowding(self, crowding_radius):
+        if not self.crowding_resolution:
+            return super().get_crowding(crowding_radius)
+        field = DensityField(self.swarm.positions,
+                             crowding_radius,
+                             self.size,
+                             wrap=self.edge_behaviour == "wrap",
+                             resolution=self.crowding_resolution,
+                             bounds=self.bounds)
+        count, center_of_mass = field.lookup()
+        return count - 1, center_of_mass
+
+
+def _work(conn, name, n):
+    """
+    The loop of a worker process: simulates its strip for every tick sent
+    over conn, until it gets None.
+    """
+    shm = SharedMemory(name)  # unlinked by the main process
+    rows = _rows(shm, n)
+    tile = Tile(NullCanvas())
+
+    while (message := conn.recv()) is not None:
+        try:
+            config, size, now, bounds, food, (low, high) = message
+            for key, value in config.items():
+                setattr(tile, key, value)
+            tile.size = size
+            tile.clock.now = now
+            tile.bounds = bounds
+            tile.food.restore(food)
+
+            y = rows["y"]
+            if tile.edge_behaviour == "wrap":
+                # around the torus, the outer strips end at the edges
+                y = wrapped(y, size[1])
+                band = strip(y, max(low, -size[1]), min(high, size[1]), ghost_width(tile), 2 * size[1])
+            else:
+                band = strip(y, low, high, ghost_width(tile))
+            local = np.nonzero(band)[0]
+            own = (y[local] >= low) & (y[local] < high)
+
+            tile.swarm.restore({"positions": np.stack((rows["x"][local], rows["y"][local]), axis=-1),
+                                "angles": rows["angle"][local],
+                                "speeds": rows["speed"][local],
+                                "last_bite": rows["last_bite"][local],
+                                "colors": np.zeros((len(local), 3), dtype="uint8")})
+            tile.swim()
+
+            mine = local[own]
+            rows["new_x"][mine], rows["new_y"][mine] = tile.swarm.positions[own].T
+            rows["new_angle"][mine] = tile.swarm.angles[own]
+            rows["new_speed"][mine] = tile.swarm.speeds[own]
+            conn.send(len(mine))
+        except Exception as e:
+            conn.send(e)
+
+    del rows
+    shm.close()
+
+
+class TiledUniverse(Universe):
+    """
+    A universe whose foshs are turned and moved by worker processes, one
+    per strip of the tank (see the module docstring). Only supports the
+    "dist" nearby method, the count and field methods can see arbitrarily
+    far.
+
+    The workers are started on the first tick, and again whenever the number
+    of foshs changed; close() stops them.
+    """
+    def __init__(self, canvas, tiles=None, **kwargs):
+        super().__init__(canvas, **kwargs)
+        self.tiles = tiles or cpu_count()
+        self.shm = None  # the shared block, for self.shared foshs
+        self.shared = 0
+        self.workers = []  # (process, connection)
+        self.owned = np.zeros(self.tiles, dtype="int")  # foshs per strip in the last tick
+
+    def _start(self, n):
+        self.close()
+        self.shm = SharedMemory(create=True, size=max(len(ROWS) * n * 8, 1))
+        self.shared = n
+        for _ in range(self.tiles):
+            conn, child = Pipe()
+            process = Process(target=_work, args=(child, self.shm.name, n), daemon=True)
+            process.start()
+            self.workers.append((process, conn))
+
+    def close(self):
+        for process, conn in self.workers:
+            conn.send(None)
+            process.join()
+        self.workers = []
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def _strips(self, y):
+        # cut at the quantiles of the heights, the outer strips reach to infinity
+        cuts = np.quantile(y, np.arange(1, self.tiles) / self.tiles) if len(y) else np.zeros(self.tiles - 1)
+        bounds = np.concatenate(([-np.inf], cuts, [np.inf]))
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def swim(self):
+        if self.nearby_method != "dist":
+            raise ValueError(f"a tiled universe only supports the 'dist' nearby method, not '{self.nearby_method}'")
+
+        swarm = self.swarm
+        n = len(swarm)
+        if self.shm is None or self.shared != n:
+            self._start(n)
+
+        with self.profiler.phase("tiles"):
+            rows = _rows(self.shm, n)
+            rows["x"][:], rows["y"][:] = swarm.positions.T
+            rows["angle"][:] = swarm.angles
+            rows["speed"][:] = swarm.speeds
+            rows["last_bite"][:] = swarm.last_bite
+
+            y = swarm.positions[:, 1]
+            if self.edge_behaviour == "wrap":
+                y = wrapped(y, self.size[1])
+            bounds = (swarm.positions.min(axis=0, initial=0), swarm.positions.max(axis=0, initial=0))
+            config = self.config()
+            food = self.food.state()
+            for (_, conn), limits in zip(self.workers, self._strips(y)):
+                conn.send((config, self.size, self.clock.now, bounds, food, limits))
+            for k, (_, conn) in enumerate(self.workers):
+                result = conn.recv()
+                if isinstance(result, Exception):
+                    raise result
+                self.owned[k] = result
+
+            swarm.positions[:] = np.stack((rows["new_x"], rows["new_y"]), axis=-1)
+            swarm.angles[:] = rows["new_angle"]
+            swarm.speeds[:] = rows["new_speed"]
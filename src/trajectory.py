@@ -0,0 +1,211 @@
+from collections import namedtuple
+import numpy as np
+from src import PALETTE
+from src.food import diamonds
+from src.pacing import FramePacer
+
+
+# file layout (all little endian):
+#   header
+#   one record per tick: record header, then positions, angles, speeds and
+#                        food as float32, colors as uint8, padded to 8 bytes
+#   keyframe index (tick, record, offset) every keyframe_interval records
+#   footer, pointing at the index
+# a file without footer (e.g. from a crashed run) is still readable, its
+# index is then rebuilt by walking the records
+MAGIC = b"FOSHTRJ1"
+INDEX_MAGIC = b"FOSHIDX1"
+HEADER = np.dtype([("magic", "S8"), ("version", "<u4"), ("keyframe_interval", "<u4"), ("dt", "<f8"), ("size", "<f8", (2,))])
+RECORD = np.dtype([("tick", "<i8"), ("time", "<f8"), ("foshs", "<u4"), ("food", "<u4")])
+INDEX = np.dtype([("tick", "<i8"), ("record", "<i8"), ("offset", "<i8")])
+FOOTER = np.dtype([("index_offset", "<u8"), ("count", "<u8"), ("magic", "S8")])
+VERSION = 1
+
+
+Frame = namedtuple("Frame", ["tick", "time", "positions", "angles", "speeds", "colors", "food"])
+
+
+def _body_size(foshs, food):
+    size = 4 * (4 * foshs + 2 * food) + 3 * foshs
+    return size + (-size % 8)
+
+
+class TrajectoryWriter():
+    """
+    Appends the state of a universe after every tick to a trajectory file.
+    """
+    def __init__(self, path, dt, size, keyframe_interval=100):
+        self.file = open(path, "wb")
+        self.keyframe_interval = keyframe_interval
+        self.index = []
+        self.count = 0
+
+        header = np.zeros((), dtype=HEADER)
+        header["magic"], header["version"], header["keyframe_interval"] = MAGIC, VERSION, keyframe_interval
+        header["dt"], header["size"] = dt, size
+        self.file.write(header.tobytes())
+        self.offset = HEADER.itemsize
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def append(self, tick, time, positions, angles, speeds, colors, food):
+        if self.count % self.keyframe_interval == 0:
+            self.index.append((tick, self.count, self.offset))
+
+        record = np.zeros((), dtype=RECORD)
+        record["tick"], record["time"], record["foshs"], record["food"] = tick, time, len(positions), len(food)
+        parts = [record.tobytes(),
+                 np.asarray(positions, dtype="<f4").tobytes(),
+                 np.asarray(angles, dtype="<f4").tobytes(),
+                 np.asarray(speeds, dtype="<f4").tobytes(),
+                 np.asarray(food, dtype="<f4").tobytes(),
+                 np.asarray(colors, dtype="uint8").tobytes()]
+        padding = -sum(map(len, parts)) % 8
+        parts.append(bytes(padding))
+        for part in parts:
+            self.file.write(part)
+
+        self.offset += RECORD.itemsize + _body_size(len(positions), len(food))
+        self.count += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        index = np.array(self.index, dtype=INDEX)
+        footer = np.zeros((), dtype=FOOTER)
+        footer["index_offset"], footer["count"], footer["magic"] = self.offset, self.count, INDEX_MAGIC
+        self.file.write(index.tobytes())
+        self.file.write(footer.tobytes())
+        self.file.close()
+
+
+class TrajectoryReader():
+    """
+    Random access to the ticks of a trajectory file. The file is memory
+    mapped, so frames are views into it and only the pages actually read are
+    loaded. Seeking to any frame starts from the closest keyframe before it.
+    """
+    def __init__(self, path):
+        self.data = np.memmap(path, dtype="uint8", mode="r")
+        header = self.data[:HEADER.itemsize].view(HEADER)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a fosh trajectory")
+        self.keyframe_interval = int(header["keyframe_interval"])
+        self.dt = float(header["dt"])
+        self.size = np.array(header["size"])
+
+        footer = self.data[-FOOTER.itemsize:].view(FOOTER)[0] if len(self.data) >= HEADER.itemsize + FOOTER.itemsize else None
+        if footer is not None and footer["magic"] == INDEX_MAGIC:
+            self.count = int(footer["count"])
+            start = int(footer["index_offset"])
+            self.index = self.data[start:len(self.data) - FOOTER.itemsize].view(INDEX)
+        else:
+            self._rebuild_index()
+
+    def _rebuild_index(self):
+        index, offset, count = [], HEADER.itemsize, 0
+        while offset + RECORD.itemsize <= len(self.data):
+            record = self.data[offset:offset + RECORD.itemsize].view(RECORD)[0]
+            end = offset + RECORD.itemsize + _body_size(int(record["foshs"]), int(record["food"]))
+            if end > len(self.data):
+                break  # the last record was cut off
+            if count % self.keyframe_interval == 0:
+                index.append((record["tick"], count, offset))
+            offset, count = end, count + 1
+        self.count = count
+        self.index = np.array(index, dtype=INDEX)
+
+    def __len__(self):
+        return self.count
+
+    def _offset(self, i):
+        keyframe = self.index[i // self.keyframe_interval]
+        offset = int(keyframe["offset"])
+        for _ in range(i - int(keyframe["record"])):
+            record = self.data[offset:offset + RECORD.itemsize].view(RECORD)[0]
+            offset += RECORD.itemsize + _body_size(int(record["foshs"]), int(record["food"]))
+        return offset
+
+    def _read(self, offset):
+        record = self.data[offset:offset + RECORD.itemsize].view(RECORD)[0]
+        n, m = int(record["foshs"]), int(record["food"])
+
+        def take(count, dtype):
+            nonlocal offset
+            size = count * np.dtype(dtype).itemsize
+            out = self.data[offset:offset + size].view(dtype)
+            offset += size
+            return out
+
+        offset += RECORD.itemsize
+        positions = take(2 * n, "<f4").reshape(n, 2)
+        angles = take(n, "<f4")
+        speeds = take(n, "<f4")
+        food = take(2 * m, "<f4").reshape(m, 2)
+        colors = take(3 * n, "uint8").reshape(n, 3)
+        return Frame(int(record["tick"]), float(record["time"]), positions, angles, speeds, colors, food), offset + (-offset % 8)
+
+    def __getitem__(self, i):
+        if not -self.count <= i < self.count:
+            raise IndexError("trajectory index out of range")
+        return self._read(self._offset(i % self.count))[0]
+
+    def record_of(self, tick):
+        """
+        Returns the index of the first record at or after the given tick (the
+        number of records if there is none), which differ once a run was
+        resumed from a checkpoint.
+        """
+        if self.count == 0:
+            return 0
+        k = max(int(np.searchsorted(self.index["tick"], tick, side="right")) - 1, 0)
+        i, offset = int(self.index[k]["record"]), int(self.index[k]["offset"])
+        while i < self.count:
+            record = self.data[offset:offset + RECORD.itemsize].view(RECORD)[0]
+            if int(record["tick"]) >= tick:
+                break
+            offset += RECORD.itemsize + _body_size(int(record["foshs"]), int(record["food"]))
+            i += 1
+        return i
+
+    def frames(self, start=0, stop=None, step=1):
+        """
+        Yields the frames of the records start, start + step, ... before stop,
+        seeking only once.
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return
+        offset = self._offset(start)
+        for i in range(start, stop):
+            frame, next_offset = self._read(offset)
+            if (i - start) % step == 0:
+                yield frame
+            offset = next_offset
+
+
+def replay(reader, canvas, start=0, stop=None, step=1):
+    """
+    Renders the records start, start + step, ... before stop of a trajectory
+    onto canvas, paced to its fps when it is shown. Returns the number of
+    frames rendered.
+    """
+    pacer = FramePacer(canvas.fps) if canvas.show else None
+    rendered = 0
+    for frame in reader.frames(start, stop, step):
+        if not canvas.is_open():
+            break
+        canvas.fill(PALETTE["background"])
+        canvas.draw_foshs(frame.positions, frame.angles, frame.colors)
+        canvas.draw_polys(diamonds(frame.food), PALETTE["food"])
+        if pacer is None:
+            canvas.update(0)
+        else:
+            canvas.update(pacer.remaining())
+            pacer.advance()
+        rendered += 1
+    return rendered
@@ -1,22 +1,56 @@
-import datetime
-import random
 from src import PALETTE
-from src import fosh
-from src.food import Food
-from src import FOSH_VEL
-from random import choice
+from src import Swarm
+from src.clock import Clock
+from src.pacing import FramePacer
+from src.profiler import NullProfiler
+from src.food import FoodField
+from src.grid import SpatialGrid, wrapped
+from src.neighbors import NeighborList
+from src.field import DensityField, FlockingField
+from src import FOSH_VEL, SPEED_TICK
+from concurrent.futures import ThreadPoolExecutor
+import json
 import numpy as np
-import time
 
 
+# settings which are part of a universe's state, restoring a state also restores them
+STATE_CONFIG = ("edge_behaviour", "nearby_method", "view_dist", "skin", "num_neighbors", "field_resolution", "crowding_resolution", "weights", "dt",
+                "food_spawn_interval", "food_spawn_chance", "food_dist")
+
+
+# foshs with more than MAX_FLOCK_SIZE others within CROWDING_RADIUS turn away from them
+MAX_FLOCK_SIZE = 10
+CROWDING_RADIUS = 150  # larger than the view distance, to evaluate the total density
+
+# number of foshs whose crowding is counted at once, bounds their pairs held in memory
+BLOCK_SIZE = 1024
 
 
 def _angle(x):
-    return np.arctan2(x[1], x[0])
+    return np.arctan2(x[..., 1], x[..., 0])
 
 
 def _norm(x):
-    return x if np.allclose(x, 0) else x / np.linalg.norm(x)
+    """
+    Normalizes each row of x, rows which are (close to) zero are left as they are.
+    """
+    length = np.linalg.norm(x, axis=-1, keepdims=True)
+    return np.where(length > 1e-8, x / np.where(length > 1e-8, length, 1), x)
+
+
+def _sum_by(index, values, n):
+    """
+    Sums the rows of values grouped by index, groups without any rows are zero.
+    """
+    return np.stack([np.bincount(index, weights=values[:, k], minlength=n) for k in range(values.shape[1])], axis=-1)
+
+
+def _mean_by(index, values, n):
+    """
+    Averages the rows of values grouped by index, groups without any rows are zero.
+    """
+    return _sum_by(index, values, n) / np.maximum(np.bincount(index, minlength=n), 1)[:, None]
+
 
 class Universe():
     def __init__(self,
@@ -31,14 +65,44 @@ class Universe():
                  food_weight=1.5,
                  food_spawn_interval=30,
                  food_spawn_chance=0.1,
-                 food_dist=300):
-        self.foshs = []
-        self.food = []
+                 food_dist=300,
+                 size=None,
+                 dt=None,
+                 profiler=None,
+                 seed=None,
+                 skin=20.0,
+                 field_resolution=8,
+                 crowding_resolution=None):
+        self.clock = Clock()
+        self.swarm = Swarm(self.clock)
+        self.food = FoodField()
         self.canvas = canvas
 
+        # the world is only tied to the canvas by default, so a universe can
+        # also be simulated without rendering it (or faster than real time)
+        self.size = canvas.size if size is None else np.asarray(size, dtype="float")
+        self.dt = 1 / canvas.fps if dt is None else float(dt)
+        self.tick_count = 0
+        self.pacer = None
+        self.previous = None  # positions and angles before the last tick, for interpolation
+        self.profiler = profiler or NullProfiler()
+        self.trajectory = None  # a TrajectoryWriter every tick is appended to
+        self.checkpoints = None  # a Checkpointer which saves the state every few ticks
+
+        # the only source of randomness, so a seed reproduces a whole run
+        self.rng = np.random.default_rng(seed)
+
+        # the tank of each fosh, when several tanks are simulated at once (see BatchUniverse)
+        self.tanks = 1
+        self.groups = None
+
         self.nearby_method = nearby_method
         self.view_dist = view_dist
+        self.skin = skin  # extra radius of the cached neighbor list, 0 to search every tick
+        self.neighbor_list = None
         self.num_neighbors = num_neighbors
+        self.field_resolution = field_resolution  # grid nodes per view_dist with nearby_method "field"
+        self.crowding_resolution = crowding_resolution  # cells per crowding radius of the density field, None to count exactly
 
         self.edge_behaviour = edge_behaviour
         self.weights = {
@@ -48,141 +112,242 @@ class Universe():
             "food": food_weight
         }
 
-        self.food_spawn_interval = food_spawn_interval  # in seconds
+        self.food_spawn_interval = food_spawn_interval  # in simulated seconds
         self.food_spawn_chance = food_spawn_chance
-        self.last_food_spawn_time = time.time()
+        self.last_food_spawn_time = self.clock.now
         self.last_food_pos = None
         self.food_dist = food_dist
 
+    @property
+    def foshs(self):
+        return self.swarm
+
     def add_fosh(self, color=None, pos=None, angle=None):
-        color = color or choice(PALETTE["accents"])
-        pos = pos or self.canvas.size * (1 - 2 * np.random.random(self.canvas.size.shape))
-        angle = int(angle or (2 * np.pi * np.random.random()))
-        self.foshs.append(fosh(color, pos, angle))
+        color = color or PALETTE["accents"][self.rng.integers(len(PALETTE["accents"]))]
+        pos = self.size * (1 - 2 * self.rng.random(self.size.shape)) if pos is None else pos
+        angle = int(angle or (2 * np.pi * self.rng.random()))
+        self.swarm.add(color, pos, angle)
 
     def populate(self, n):
-        for _ in range(n):
-            self.add_fosh()
+        # same as n calls to add_fosh, but with one random draw per attribute
+        accents = np.array(PALETTE["accents"], dtype="uint8")
+        colors = accents[self.rng.integers(len(accents), size=n)]
+        positions = self.size * (1 - 2 * self.rng.random((n, 2)))
+        angles = np.trunc(2 * np.pi * self.rng.random(n))
+        self.swarm.add(colors, positions, angles)
+
 
-    
     def spawn_food(self):
+        position = self._food_position(self.rng, self.swarm.positions)
+        self.food.sprinkle(position, 50, self.food_spawn_chance, self.rng)
+
+    def _food_position(self, rng, positions):
+        """
+        Picks where to spawn food, preferably not right on top of a fosh at positions.
+        """
         grid_size = 100  # Size of each grid cell
-        canvas_size = np.array(self.canvas.size)  # Ensure canvas size is a numpy array
+        canvas_size = np.array(self.size)  # Ensure canvas size is a numpy array
 
-        # Cast the result to integer for the random.randint
+        # Cast the result to integer for the random integers
         max_x = int(canvas_size[0] // grid_size)
         max_y = int(canvas_size[1] // grid_size)
-        
+
         # minimum x and y are the negative canvas size
         min_x = 0 - int(canvas_size[0] // grid_size)
         min_y = 0 - int(canvas_size[1] // grid_size)
-        
+
         # Cut off the most extreme 10% of the canvas
         max_x = int(max_x * 0.9)
         max_y = int(max_y * 0.9)
         min_x = int(min_x * 0.9)
         min_y = int(min_y * 0.9)
 
-        loops = 0
-        while True:
-            # Generate random position for food within canvas bounds
-            x_pos = random.randint(min_x, max_x - 1) * grid_size
-            y_pos = random.randint(min_y, max_y - 1) * grid_size
-            
-            is_near_fosh = False
-            for fosh in self.foshs:
-                if fosh.dist(np.array([x_pos, y_pos])) < 3:
-                    is_near_fosh = True
-                    
-            if not is_near_fosh:
-                break
-            
-            loops += 1
-            if loops > 100:
-                print("Could not spawn food optimally. Spawning randomly.")
-                break
-
-        food_position = np.array([x_pos, y_pos])
-        food = Food(pos=food_position)
-        self.food = food.sprinkle(self.canvas, food_position, 50, self.food, self.food_spawn_chance)
-
-
-
-    def get_nearby(self, fosh):
-        if self.nearby_method == "dist":
-            out = []
-            for other in self.foshs:
-                if fosh.dist(other.pos) < self.view_dist and fosh is not other:
-                    out.append(other)
-            return out
-        elif self.nearby_method == "count":
-            return sorted((other for other in self.foshs if other is not fosh),
-                         key=lambda other: fosh.dist(other.pos))[:self.num_neighbors]
-
-    def reorient(self, fosh):
-        """
-        Calculates the new direction of the fosh with 5 rules: cohesion,
-        separation, alignment, food attraction, and crowding avoidance.
+        # Generate all random positions for food within canvas bounds at once,
+        # and take the first one that is not right on top of a fosh
+        tries = 101
+        candidates = np.stack((rng.integers(min_x, max_x, size=tries),
+                               rng.integers(min_y, max_y, size=tries)), axis=-1) * grid_size
+        q, _, _ = SpatialGrid(positions, 3, self.size).query(candidates, 3)
+        free = np.setdiff1d(np.arange(tries), q)
+        if len(free) == 0:
+            print("Could not spawn food optimally. Spawning randomly.")
+        return candidates[free[0] if len(free) else -1].astype("float")
+
+
+
+    def _displacement(self, a, b):
+        """
+        Returns b - a, the shortest way around the tank when wrapping.
         """
-        # Get nearby foshs
-        nearby = self.get_nearby(fosh)
+        return wrapped(b - a, self.size) if self.edge_behaviour == "wrap" else b - a
 
-        avg_pos = np.array((0, 0), dtype="float")  # cohesion
-        avg_dir = np.array((0, 0), dtype="float")  # alignment
-        avoid_foshs = np.array((0, 0), dtype="float")  # separation
-        avoid_walls = np.array((0, 0), dtype="float")  # wall avoidance
-        food_attraction = np.array((0, 0), dtype="float")  # food attraction
-        crowding_avoidance = np.array((0, 0), dtype="float")  # crowding avoidance
+    def get_nearby(self):
+        """
+        Finds which foshs each fosh can see. Returns two index arrays (i, j),
+        meaning fosh i sees fosh j; a fosh never sees itself.
+        """
+        # with a skin, the neighbors come from a list which is only searched again
+        # once the foshs moved far enough
+        if self.skin > 0:
+            if self.neighbor_list is None:
+                self.neighbor_list = NeighborList(self.view_dist, self.skin, self.size, wrap=self.edge_behaviour == "wrap")
+            i, j, _ = self.neighbor_list.pairs(self.swarm.positions, self.groups)
+            return i, j
+
+        # the grid is rebuilt every tick, which is cheap compared to the queries
+        grid = SpatialGrid(self.swarm.positions, self.view_dist, self.size, wrap=self.edge_behaviour == "wrap", groups=self.groups)
+        i, j, _ = grid.pairs(self.view_dist)
+        return i, j
+
+    def get_nearest(self):
+        """
+        Finds the num_neighbors closest foshs of each fosh. Returns an (n, k)
+        index matrix, where k is num_neighbors (or n - 1 for tiny swarms).
+        """
+        positions = self.swarm.positions
+        size = self.size
 
-        # Crowding parameters
-        max_flock_size = 10
-        crowding_radius = 150  # Larger radius to evaluate total density
+        # size the cells so an evenly spread swarm has about 2k foshs per 3x3 block
+        area_per_fosh = self.tanks * np.prod(2 * size) / max(len(positions), 1)
+        cell_size = np.sqrt(2 * self.num_neighbors * area_per_fosh / 9)
+        grid = SpatialGrid(positions, cell_size, size, wrap=self.edge_behaviour == "wrap", groups=self.groups)
+        return grid.knn(self.num_neighbors)
 
-        # Calculate fosh behaviors
-        if len(nearby) != 0: # type: ignore
-            for i, other in enumerate(nearby): # type: ignore
-                diff = other.pos - fosh.pos # type: ignore
+    def get_crowding(self, crowding_radius):
+        """
+        Counts the other foshs within crowding_radius of each fosh, and the
+        center of mass of all foshs (including itself) in that radius.
+
+        With a crowding_resolution, both are looked up in a density field
+        binned at that many cells per radius instead (see DensityField),
+        which is a lot faster for large schools but approximate. The
+        direction away from the center of mass of the crowded foshs is off by
+        a median 12-20 degrees at 8 (70-85 for the worst tenth), and 5 degrees
+        at 32 (about 30 for the worst tenth).
+        """
+        positions = self.swarm.positions
+        wrap = self.edge_behaviour == "wrap"
+        if self.crowding_resolution:
+            field = DensityField(positions, crowding_radius, self.size, wrap=wrap, groups=self.groups, resolution=self.crowding_resolution)
+            count, center_of_mass = field.lookup()
+            return count - 1, center_of_mass
+
+        n = len(positions)
+        grid = SpatialGrid(positions, crowding_radius, self.size, wrap=wrap, groups=self.groups)
+        density = np.zeros(n, dtype="int")
+        offset = np.zeros_like(positions)
+        # a block of foshs at a time, so only the pairs of one block are ever held
+        for start in range(0, n, BLOCK_SIZE):
+            block = slice(start, start + BLOCK_SIZE)
+            q, j, diff = grid.query(positions[block], crowding_radius, None if self.groups is None else self.groups[block])
+            other = q + start != j
+            q, diff = q[other], diff[other]
+            density[block] = np.bincount(q, minlength=len(positions[block]))
+            offset[block] = _sum_by(q, diff, len(positions[block]))
+        # the fosh itself is part of the center of mass, with no displacement
+        return density, positions + offset / (density + 1)[:, None]
+
+    def has_food(self):
+        """
+        Whether there is any food in the tank of each fosh.
+        """
+        if self.groups is None:
+            return np.full(len(self.swarm), bool(self.food))
+        return (np.bincount(self.food.groups, minlength=self.tanks) > 0)[self.groups]
 
-                avg_pos += (diff - avg_pos) / (i + 1)  # running average for cohesion
-                avg_dir += (other.dir - avg_dir) / (i + 1)  # type: ignore # running average for alignment
-                avoid_foshs -= diff / np.dot(diff, diff)  # separation
+    def flocking(self):
+        """
+        Calculates the cohesion, alignment and separation directions of every
+        fosh from the foshs it can see.
+        """
+        swarm = self.swarm
+        n = len(swarm)
+        positions = swarm.positions
+
+        if self.nearby_method == "count":
+            # consume the (n, k) neighbor matrix directly, row-wise
+            with self.profiler.phase("neighbors"):
+                nearest = self.get_nearest()
+            if nearest.shape[1] == 0:
+                return np.zeros((n, 2)), np.zeros((n, 2)), np.zeros((n, 2))
+            diff = self._displacement(positions[:, None, :], positions[nearest])
+            dist_sq = np.sum(diff**2, axis=-1, keepdims=True)
+            avg_pos = diff.mean(axis=1)
+            avg_dir = swarm.dirs[nearest].mean(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                avoid_foshs = -np.sum(np.where(dist_sq > 0, diff / dist_sq, 0), axis=1)
+        elif self.nearby_method == "field":
+            # approximate the sums over all foshs in view_dist on a grid (see FlockingField)
+            with self.profiler.phase("neighbors"):
+                field = FlockingField(positions,
+                                      swarm.dirs,
+                                      self.view_dist,
+                                      self.size,
+                                      wrap=self.edge_behaviour == "wrap",
+                                      groups=self.groups,
+                                      resolution=self.field_resolution)
+                avg_pos, avg_dir, avoid_foshs = field.lookup()
+        else:
+            # accumulate over all (fosh, neighbor) pairs at once
+            with self.profiler.phase("neighbors"):
+                i, j = self.get_nearby()
+            diff = self._displacement(positions[i], positions[j])
+            dist_sq = np.sum(diff**2, axis=-1, keepdims=True)
+            avg_pos = _mean_by(i, diff, n)
+            avg_dir = _mean_by(i, swarm.dirs[j], n)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                avoid_foshs = -_sum_by(i, np.where(dist_sq > 0, diff / dist_sq, 0), n)
+
+        return _norm(avg_pos), _norm(avg_dir), _norm(avoid_foshs)
+
+    def reorient(self):
+        """
+        Calculates the new direction of every fosh with 5 rules: cohesion,
+        separation, alignment, food attraction, and crowding avoidance.
+        Returns the new angles as an array, one per fosh.
+        """
+        swarm = self.swarm
+        n = len(swarm)
+        positions = swarm.positions
+        size = self.size
 
-            # Normalize behaviors
-            avg_pos = _norm(avg_pos)
-            avg_dir = _norm(avg_dir)
-            avoid_foshs = _norm(avoid_foshs)
+        # Calculate fosh behaviors
+        avg_pos, avg_dir, avoid_foshs = self.flocking()
 
         # Check for overall density in a larger radius
-        density = sum(1 for other in self.foshs if fosh.dist(other.pos) < crowding_radius and fosh is not other)
-        if density > max_flock_size:
-            # Apply repulsion from the center of all nearby foshs in the larger radius
-            center_of_mass = np.mean([other.pos for other in self.foshs if fosh.dist(other.pos) < crowding_radius], axis=0)
-            crowding_avoidance = _norm(fosh.pos - center_of_mass)
+        crowding_avoidance = np.zeros((n, 2), dtype="float")
+        with self.profiler.phase("crowding"):
+            density, center_of_mass = self.get_crowding(CROWDING_RADIUS)
+        crowded = density > MAX_FLOCK_SIZE
+        # Apply repulsion from the center of all nearby foshs in the larger radius
+        crowding_avoidance[crowded] = _norm(positions[crowded] - center_of_mass[crowded])
 
         # Handle wall avoidance
-        if self.edge_behaviour == "avoid" and (np.abs(fosh.pos) > self.canvas.size - self.view_dist).any():
-            for i, (coord, lower, upper) in enumerate(zip(fosh.pos, -self.canvas.size, self.canvas.size)):
-                if (diff := coord - lower) < self.view_dist:
-                    avoid_walls[i] += np.abs(1 / diff)
-                if (diff := upper - coord) < self.view_dist:
-                    avoid_walls[i] -= np.abs(1 / diff)
+        avoid_walls = np.zeros((n, 2), dtype="float")
+        if self.edge_behaviour == "avoid":
+            near_wall = (np.abs(positions) > size - self.view_dist).any(axis=1)
+            with np.errstate(divide="ignore"):
+                lower = positions[near_wall] + size
+                upper = size - positions[near_wall]
+                avoid_walls[near_wall] = (np.where(lower < self.view_dist, np.abs(1 / lower), 0) -
+                                          np.where(upper < self.view_dist, np.abs(1 / upper), 0))
 
         # Calculate food attraction
-        if self.food:
-            closest_food = min(self.food, key=lambda f: fosh.dist(f.pos))
-            if fosh.dist(closest_food.pos) <= self.food_dist:
-                direction_to_food = closest_food.pos - fosh.pos
-                food_attraction = _norm(direction_to_food)
-                
-                if fosh.is_hungry:
-                    if fosh.speed < FOSH_VEL * 6:
-                        fosh.speed *= 1.08
-                else:
-                    if fosh.speed < FOSH_VEL * 3:
-                        fosh.speed *= 1.02
-        else:
-            if fosh.speed > FOSH_VEL:
-                fosh.speed *= 0.95
+        food_attraction = np.zeros((n, 2), dtype="float")
+        # the speed factors are per SPEED_TICK, so scale them to the actual timestep
+        speeds = swarm.speeds
+        steps = self.dt / SPEED_TICK
+        fed = self.has_food()
+        if fed.any():
+            with self.profiler.phase("food"):
+                closest, direction_to_food = self.food.nearest(positions, self.food_dist, size, self.groups)
+            in_reach = closest >= 0
+            food_attraction[in_reach] = _norm(direction_to_food[in_reach])
+
+            hungry = swarm.hungry()
+            speeds[in_reach & hungry & (speeds < FOSH_VEL * 6)] *= 1.08**steps
+            speeds[in_reach & ~hungry & (speeds < FOSH_VEL * 3)] *= 1.02**steps
+        speeds[~fed & (speeds > FOSH_VEL)] *= 0.95**steps
 
         # Combine all behaviors
         sum_vector = (_norm(avoid_walls) +
@@ -191,62 +356,224 @@ class Universe():
                     self.weights["alignment"] * avg_dir +
                     crowding_avoidance)  # Add crowding avoidance
 
-        if self.food:
-            sum_vector += self.weights["food"] * food_attraction
+        sum_vector[fed] += (self.weights["food"] * food_attraction)[fed]
 
         sum_vector = _norm(sum_vector)
 
-        if np.allclose(sum_vector, 0):
-            return fosh.angle
-        else:
-            return _angle(sum_vector)
+        still = np.all(np.abs(sum_vector) <= 1e-8, axis=1)
+        return np.where(still, swarm.angles, _angle(sum_vector))
 
 
 
-    def draw(self):
-        self.canvas.fill(PALETTE["background"])
-        for fosh in self.foshs:
-            fosh.draw(self.canvas)
-        for food in self.food:
-            food.draw(self.canvas)
-        self.canvas.update()
+    def interpolated(self, alpha):
+        """
+        Returns the positions and angles of all foshs a fraction alpha of the
+        way from the state before the last tick to the current one.
+        """
+        positions, angles = self.swarm.positions, self.swarm.angles
+        if self.previous is None or len(self.previous[0]) != len(positions) or alpha >= 1:
+            return positions, angles
+
+        previous_positions, previous_angles = self.previous
+        turned = wrapped(angles - previous_angles, np.pi)  # the short way round
+        return (previous_positions + alpha * self._displacement(previous_positions, positions),
+                (previous_angles + alpha * turned) % (2 * np.pi))
+
+    def snapshot(self, alpha=1.0):
+        """
+        Returns copies of everything draw needs (the interpolated positions
+        and angles, the colors and the food diamonds), so a frame can be
+        drawn from it while the universe ticks on.
+        """
+        positions, angles = self.interpolated(alpha)
+        return positions.copy(), angles.copy(), self.swarm.colors.copy(), self.food.diamonds()
+
+    def draw(self, wait=None, alpha=1.0, snapshot=None):
+        if self.canvas.headless:
+            return
+        with self.profiler.phase("draw"):
+            positions, angles, colors, food = snapshot or (*self.interpolated(alpha), self.swarm.colors, self.food.diamonds())
+            self.canvas.fill(PALETTE["background"])
+            self.canvas.draw_foshs(positions, angles, colors)
+            self.canvas.draw_polys(food, self.food.color)
+            if self.profiler.enabled and self.profiler.hud:
+                self.canvas.draw_text(self.profiler.lines())
+        self.canvas.update(wait)
 
     def tick(self):
+        self.previous = (self.swarm.positions.copy(), self.swarm.angles.copy())
+
         # Spawn food at intervals
-        current_time = time.time()
+        current_time = self.clock.now
         if current_time - self.last_food_spawn_time >= self.food_spawn_interval:
-            self.spawn_food()
+            with self.profiler.phase("spawn_food"):
+                self.spawn_food()
             self.last_food_spawn_time = current_time
 
-        # Calculate new directions
-        angles = []
-        for fosh in self.foshs:
-            angles.append(self.reorient(fosh))
-
-        for fosh, angle in zip(self.foshs, angles):
-            if self.edge_behaviour == "wrap":
-                self.wrap(fosh)
-            fosh.turn_to(angle, 1 / self.canvas.fps)
-            fosh.tick(1 / self.canvas.fps)
+        self.swim()
 
         # Check if any fosh has reached food
-        self.check_food_consumption()
+        with self.profiler.phase("consume"):
+            self.check_food_consumption()
+        self.clock.advance(self.dt)
+        self.tick_count += 1
+
+        if self.trajectory is not None:
+            with self.profiler.phase("trajectory"):
+                self.trajectory.append(self.tick_count, self.clock.now, self.swarm.positions, self.swarm.angles,
+                                       self.swarm.speeds, self.swarm.colors, self.food.positions)
+
+        if self.checkpoints is not None and self.tick_count % self.checkpoints.every == 0:
+            with self.profiler.phase("checkpoint"):
+                self.checkpoints.save(self.tick_count, self.state())
+
+    def swim(self):
+        """
+        Turns every fosh to its new direction and moves it by one tick.
+        """
+        with self.profiler.phase("reorient"):
+            angles = self.reorient()
+
+        with self.profiler.phase("move"):
+            if self.edge_behaviour == "wrap":
+                self.wrap()
+            self.swarm.turn_to(angles, self.dt)
+            self.swarm.tick(self.dt)
 
     def check_food_consumption(self):
         consumption_radius = 10  # Define how close a fosh needs to be to consume food
-        for fosh in self.foshs:
-            for food in self.food:
-                if fosh.dist(food.pos) < consumption_radius:
-                    self.food.remove(food)
-                    # Optionally, add behaviors like increasing fosh's speed or energy
-                    fosh.speed *= 1.5
-                    fosh.last_bite = datetime.datetime.now()
-                    break  # Assuming one food consumed at a time
-
-    def wrap(self, fosh):
-        fosh.pos = (fosh.pos + self.canvas.size) % (2 * self.canvas.size) - self.canvas.size
-
-    def loop(self):
-        while self.canvas.is_open():
-            self.draw()
-            self.tick()
+        if not self.food:
+            return np.empty(0, dtype="int")
+        eaters = self.food.consume(self.swarm.positions, consumption_radius, self.size, self.groups)
+        # Optionally, add behaviors like increasing fosh's speed or energy
+        self.swarm.speeds[eaters] *= 1.5
+        self.swarm.last_bite[eaters] = self.clock.now
+        return eaters
+
+    def wrap(self):
+        self.swarm.positions[:] = wrapped(self.swarm.positions, self.size)
+
+    def config(self):
+        """
+        Returns the settings which are part of the state (see STATE_CONFIG).
+        """
+        return {key: getattr(self, key) for key in STATE_CONFIG}
+
+    def state(self):
+        """
+        Returns a copy of everything that decides how the universe goes on,
+        as a flat dict of arrays (e.g. to save with np.savez): the foshs, the
+        food, the settings, the clock and timers, and the random generator.
+        """
+        state = {f"swarm_{key}": value for key, value in self.swarm.state().items()}
+        state.update({f"food_{key}": value for key, value in self.food.state().items()})
+        state.update({
+            "size": np.array(self.size, dtype="float"),
+            "config": np.array(json.dumps(self.config())),
+            "rng": np.array(json.dumps(self.rng.bit_generator.state)),
+            "now": np.array(self.clock.now),
+            "tick_count": np.array(self.tick_count),
+            "last_food_spawn_time": np.array(self.last_food_spawn_time),
+        })
+        if self.previous is not None:
+            state["previous_positions"], state["previous_angles"] = (a.copy() for a in self.previous)
+        return state
+
+    def restore(self, state):
+        """
+        Continues from a `state`, exactly as the universe it was taken from.
+        """
+        self.swarm.restore({key[6:]: value for key, value in state.items() if key.startswith("swarm_")})
+        self.food.restore({key[5:]: value for key, value in state.items() if key.startswith("food_")})
+        self.size = np.array(state["size"], dtype="float")
+        for key, value in json.loads(str(state["config"])).items():
+            setattr(self, key, value)
+        self.rng.bit_generator.state = json.loads(str(state["rng"]))
+        self.clock.now = float(state["now"])
+        self.tick_count = int(state["tick_count"])
+        self.last_food_spawn_time = float(state["last_food_spawn_time"])
+        self.previous = (state["previous_positions"], state["previous_angles"]) if "previous_positions" in state else None
+        self.neighbor_list = None
+
+    def loop(self, ticks=None, concurrent=False):
+        """
+        Runs the simulation until the canvas is closed, or for at most the
+        given number of ticks.
+
+        The simulation runs at its own fixed rate of 1 / dt ticks per second,
+        decoupled from the canvas' fps: every frame runs as many ticks as fit
+        into its interval, and frames in between two ticks are drawn
+        interpolated between them.
+
+        Frames are paced to the canvas' fps by deadline: drawing only waits for
+        what is left of the frame's budget, and when a frame is already late it
+        is not rendered at all (but still simulated). Headless canvases are not
+        paced, they tick as fast as possible.
+
+        With concurrent=True, the ticks of the next frame run on a worker
+        thread while the current frame is drawn from a snapshot, which hides
+        the cheaper of the two (numpy and opencv release the GIL for most of
+        their work). The ticks are the same either way.
+        """
+        stop = None if ticks is None else self.tick_count + ticks
+        running = lambda: self.canvas.is_open() and (stop is None or self.tick_count < stop)
+
+        self.pacer = None if self.canvas.headless else FramePacer(self.canvas.fps)
+        if self.pacer is None:
+            while running():
+                self.tick()
+            return
+
+        if concurrent:
+            self._loop_concurrent(running)
+            return
+
+        accumulator = 0.0  # simulation time owed to the frames so far
+        while running():
+            accumulator += self.pacer.interval
+            while accumulator >= self.dt - 1e-9 and running():
+                self.tick()
+                accumulator -= self.dt
+
+            if not self.pacer.overrun():
+                self.draw(wait=self.pacer.remaining(), alpha=max(accumulator, 0) / self.dt)
+            self.pacer.advance()
+
+    def _loop_concurrent(self, running):
+        accumulator = 0.0
+
+        def owed():
+            # the ticks owed to the next frame, and the alpha to draw it at
+            nonlocal accumulator
+            accumulator += self.pacer.interval
+            count = 0
+            while accumulator >= self.dt - 1e-9:
+                accumulator -= self.dt
+                count += 1
+            return count, max(accumulator, 0) / self.dt
+
+        def run(count):
+            for _ in range(count):
+                if not running():
+                    break
+                self.tick()
+
+        with ThreadPoolExecutor(1, thread_name_prefix="fosh-tick") as worker:
+            count, alpha = owed()
+            pending = worker.submit(run, count)
+            while True:
+                pending.result()
+
+                # snapshot this frame, then let the worker tick the next one
+                late = self.pacer.overrun()
+                snapshot = None if late else self.snapshot(alpha)
+                more = running()
+                if more:
+                    count, alpha = owed()
+                    pending = worker.submit(run, count)
+
+                if not late:
+                    self.draw(wait=self.pacer.remaining(), snapshot=snapshot)
+                self.pacer.advance()
+                if not more:
+                    break